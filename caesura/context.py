@@ -0,0 +1,5 @@
+from contextvars import ContextVar
+
+
+# name of the phase that is currently executed, used to attribute LLM calls to phases
+current_phase = ContextVar("current_phase", default=None)
@@ -0,0 +1,62 @@
+from pathlib import Path
+import hashlib
+import logging
+import os
+import uuid
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+PARQUET_PATH = Path(".parquet/")
+ROW_GROUP_SIZE = 10_000
+
+
+class ParquetSource():
+    """Columnar file backing a lazy table. Schema and row count are read from the file metadata only."""
+
+    def __init__(self, path: Path):
+        import pyarrow.parquet as pq  # only needed in lazy mode
+        self.path = Path(path)
+        metadata = pq.read_metadata(self.path)
+        self.num_rows = metadata.num_rows
+        self.dtypes = metadata.schema.to_arrow_schema().empty_table().to_pandas().dtypes
+        self.columns = self.dtypes.index
+
+    def read(self, columns=None):
+        """Reads the given columns, or the whole table."""
+        return pd.read_parquet(self.path, columns=None if columns is None else list(columns))
+
+    def head(self, num_rows, columns=None):
+        """Reads the first rows of the table without touching the remaining row groups."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        columns = list(self.columns if columns is None else columns)
+        batches = pq.ParquetFile(self.path).iter_batches(batch_size=max(num_rows, 1), columns=columns)
+        batch = next(batches, None)
+        if batch is None or num_rows == 0:
+            return self.read(columns).head(0)
+        return pa.Table.from_batches([batch]).to_pandas().head(num_rows)
+
+
+def csv_to_parquet(csv_path: Path, cache_dir: Path = PARQUET_PATH, path_columns=()):
+    """Converts a CSV file to Parquet once and returns the path of the cached file.
+
+    The cache is keyed by the location, size and modification time of the CSV file.
+    """
+    csv_path = Path(csv_path)
+    stat = csv_path.stat()
+    key = f"{csv_path.resolve()}-{stat.st_size}-{stat.st_mtime_ns}-{sorted(path_columns)}"
+    path = Path(cache_dir) / f"{csv_path.stem}-{hashlib.blake2b(key.encode(), digest_size=8).hexdigest()}.parquet"
+    if path.exists():
+        return path
+
+    data = pd.read_csv(csv_path)
+    for p in path_columns:
+        data[p] = data[p].apply(lambda x: str(csv_path.parent / x))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp-{uuid.uuid4().hex}")
+    data.to_parquet(tmp_path, index=False, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    logger.info(f"Converted {csv_path} to {path}.")
+    return path
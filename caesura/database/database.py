@@ -1,9 +1,18 @@
+from collections import Counter, OrderedDict
+import itertools
 import logging
-from caesura.database.index import RelevantValueIndex
+import re
+import shutil
+import tempfile
+from caesura.database.columnar import PARQUET_PATH
+from caesura.database.index import INDEX_PATH, build_indexes
+from caesura.database.join_graph import JoinGraph
+from caesura.database.serialization import Serializer
+from caesura.database.manifest import MANIFEST_PATH
+from caesura.database.sql_engine import SqlEngine
+from caesura.database.suggestions import SuggestionIndex
 from caesura.database.table import Table
 from pathlib import Path
-from fuzzywuzzy import fuzz
-from pandasql import sqldf
 import sqlparse
 
 from caesura.observations import ExecutionError
@@ -11,6 +20,8 @@ from caesura.observations import ExecutionError
 
 logger = logging.getLogger(__name__)
 
+PROMPT_CACHE_SIZE = 512
+
 class Link():
     def __init__(self, table1, table2, column1, column2):
         """Initializes a link between two tables."""
@@ -27,12 +38,47 @@ class Link():
 
 
 class Database():
-    def __init__(self):
-        """Initializes a database."""
+    def __init__(self, memory_budget=None, spill_dir=None, index_dir=INDEX_PATH, lazy=False, parquet_dir=PARQUET_PATH,
+                 manifest_dir=MANIFEST_PATH, peek_token_budget=None):
+        """Initializes a database.
+
+        Args:
+            memory_budget (int): maximum number of bytes held by the working set. None means unbounded.
+            spill_dir (Path): directory to spill working set tables to. Defaults to a temporary directory.
+            index_dir (Path): directory to persist relevant value indexes in. None disables persistence.
+            lazy (bool): back tabular and text tables by Parquet files and only read the columns that are used.
+            parquet_dir (Path): directory to store the Parquet files of lazy tables in.
+            manifest_dir (Path): directory to store the manifests of image directories in.
+            peek_token_budget (int): maximum number of tokens of a table peek in a prompt. None means unbounded.
+        """
         self._tables = {}
         self._working_set = {}
         self._relevant_values_indexes = {}
+        self._sql_engine = SqlEngine()
+        self._suggestions = SuggestionIndex()
+        self._join_graph = JoinGraph()
+        self.index_dir = index_dir
+        self.lazy = lazy
+        self.parquet_dir = parquet_dir
+        self.manifest_dir = manifest_dir
         self.history = list()
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._owns_spill_dir = False
+        self.spill_counters = Counter()
+        self._prompt_cache = OrderedDict()
+        self.prompt_cache_counters = Counter()
+        self.serializer = Serializer()
+        self.peek_token_budget = peek_token_budget
+        self._relevant_columns = frozenset()
+        self._working_set_bytes = {}
+        self._shared_bytes = {}
+        self._sql_bytes = {}
+        self._last_access = {}
+        self._access_counter = itertools.count()
+        self._referenced_tables = None
+        self._pinned_tables = set()
+        self._spilled_tables = []
 
     @property
     def tables(self):
@@ -40,27 +86,136 @@ class Database():
 
     def clear_working_set(self):
         self.history = list()
+        for name in self._working_set:
+            self._sql_engine.drop(name)
+            self._suggestions.remove_table(name)
+            if name in self._tables:  # working set table shadowed a base table
+                self._suggestions.add_table(self._tables[name])
+        for table in self._spilled_tables:
+            table.remove_spill_file()
+        if self._owns_spill_dir:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+            self._owns_spill_dir = False
         self._working_set = {}
+        self._working_set_bytes = {}
+        self._shared_bytes = {}
+        self._sql_bytes = {}
+        self._last_access = {}
+        self._referenced_tables = None
+        self._spilled_tables = []
+        self._relevant_columns = frozenset()
         logger.info("Working set cleared!", stack_info=True)
 
     def final_result(self):
         if self.history:
-            return self._working_set[self.history[-1]]
+            result = self._working_set[self.history[-1]]
+            result.data_frame  # make sure a spilled result survives clearing the working set
+            return result
 
     def get_table_by_name(self, name: str):
         """Returns a table by name."""
         if name in self._tables:
             return self._tables[name]
         if name in self._working_set:
+            self._touch(name)
             return self._working_set[name]
         raise ValueError(f"table {name} not found. " + self.alternatives(name))
 
+    def set_referenced_tables(self, names):
+        """Sets the tables referenced by upcoming plan steps. Other working set tables are spilled first."""
+        self._referenced_tables = set(names)
+
+    def _touch(self, name):
+        """Marks a working set table as used. Spilled tables count towards the memory budget again."""
+        if name not in self._working_set:
+            return
+        self._last_access[name] = next(self._access_counter)
+        self._enforce_memory_budget(keep=name)
+
+    def _enforce_memory_budget(self, keep):
+        """Spills working set tables to disk until the working set fits into the memory budget.
+
+        The copies of working set tables in the SQL engine count towards the budget and are released first, since they
+        are cheap to recreate. Tables whose columns are still shared with a loaded derived table are not spilled, as
+        that frees no memory.
+        """
+        if self.memory_budget is None:
+            return
+        in_memory = [n for n, t in self._working_set.items() if not t.is_spilled]
+        used = sum(self._working_set_bytes[n] for n in in_memory) + sum(self._sql_bytes.values())
+        # spill unreferenced tables first, least recently used ones first
+        referenced = self._referenced_tables if self._referenced_tables is not None else set()
+        candidates = sorted((n for n in in_memory if n != keep and n not in self._pinned_tables),
+                            key=lambda n: (n in referenced, self._last_access.get(n, -1)))
+        for name in candidates:
+            if used <= self.memory_budget:
+                break
+            used -= self._release_sql_copy(name)
+        while used > self.memory_budget:
+            name = next((n for n in candidates if not self._is_shared(n)), None)
+            if name is None:
+                break
+            candidates.remove(name)
+            self._spill(name)
+            used -= self._working_set_bytes[name]
+
+    def _is_shared(self, name):
+        """Whether a loaded working set table derived from the given one references its columns."""
+        table = self._working_set[name]
+        return any(t.parent is table and not t.is_spilled and self._shared_bytes.get(n)
+                   for n, t in self._working_set.items())
+
+    def _update_memory_usage(self, name):
+        """Computes the bytes a working set table is charged with. Columns shared with a loaded parent are charged to
+        the parent, all other columns to the table itself."""
+        table = self._working_set[name]
+        memory_usage = table.memory_usage()
+        parent = table.parent
+        parent_loaded = parent is not None and (self._tables.get(parent.name) is parent
+                                                or self._working_set.get(parent.name) is parent)
+        self._shared_bytes[name] = memory_usage["shared_bytes"] if parent_loaded else 0
+        self._working_set_bytes[name] = memory_usage["own_bytes"] + memory_usage["shared_bytes"] \
+            - self._shared_bytes[name]
+        return memory_usage
+
+    def _spill(self, name):
+        """Spills a working set table to disk."""
+        if self.spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="caesura-spill-"))
+            self._owns_spill_dir = True
+        table = self._working_set[name]
+        self._release_sql_copy(name)
+        table.spill(self.spill_dir, counters=self.spill_counters, on_reload=self._on_reload)
+        self._spilled_tables.append(table)
+
+    def _release_sql_copy(self, name):
+        """Drops the copy of a working set table from the SQL engine. Returns the number of bytes released."""
+        self._sql_engine.drop(name)
+        return self._sql_bytes.pop(name, 0)
+
+    def _on_reload(self, table):
+        """Charges a reloaded working set table against the memory budget again."""
+        if self._working_set.get(table.name) is not table:
+            return
+        self._update_memory_usage(table.name)
+        self._touch(table.name)
+
     def register_working_memory(self, table, peek=False):
         """Registers a table as working memory."""
-        if len(table.data_frame) == 0:
+        if table.num_rows == 0:
             raise ExecutionError(description="Empty table encountered. Check your filter or join conditions.")
         self.history.append(table.name)
+        replaced = self._working_set.get(table.name)
         self._working_set[table.name] = table
+        self._release_sql_copy(table.name)  # registered lazily once a query mentions it
+        self._suggestions.add_table(table)
+        memory_usage = self._update_memory_usage(table.name)
+        for name, other in self._working_set.items():  # columns shared with the replaced table are charged to others
+            if replaced is not None and other.parent is replaced and other is not table and not other.is_spilled:
+                self._update_memory_usage(name)
+        logger.debug(f"Memory usage of {table.name}: {memory_usage}")
+        self._touch(table.name)
         added_str = f"Table {table.name} has been added."
         rows_str = f"The table {table.name} has {table.data_frame.shape[0]} rows."
         columns_str = f"The table {table.name} has these columns: {table.data_frame.columns.tolist()}"
@@ -72,35 +227,60 @@ class Database():
         else:
             return f"{added_str}\n{columns_str}\n{rows_str}"
 
+    def memory_report(self):
+        """Reports the memory used by each table in the working set."""
+        return {name: table.memory_usage() for name, table in self._working_set.items()}
+
     def add_image_table(self, name: str, path: Path, description: str, file_paths=()):
         """Adds an image table to the database."""
-        self._tables[name] = Table.create_image_table(name, path, description, file_paths=file_paths)
+        self._add_table(Table.create_image_table(name, path, description, file_paths=file_paths,
+                                                 manifest_dir=self.manifest_dir))
 
     def add_text_table(self, name: str, path: Path, description: str):
         """Adds a text table to the database."""
-        self._tables[name] = Table.create_text_table(name, path, description)
+        self._add_table(Table.create_text_table(name, path, description, lazy=self.lazy, cache_dir=self.parquet_dir))
 
     def add_tabular_table(self, name: str, path: Path, description: str, path_columns=()):
         """Adds a tabular table to the database."""
-        self._tables[name] = Table.create_tabular_table(name, path, description, path_columns)
+        self._add_table(Table.create_tabular_table(name, path, description, path_columns,
+                                                   lazy=self.lazy, cache_dir=self.parquet_dir))
+
+    def _add_table(self, table):
+        """Adds a base table to the database and registers it in the SQL engine. Lazy tables register on first use."""
+        self._tables[table.name] = table
+        self._suggestions.add_table(table)
+        if not table.is_lazy:
+            self._sql_engine.register(table.name, table.data_frame)
 
     def build_relevant_values_index(self, table, *columns):
-        for c in columns:
-            values = self.tables[table].data_frame[c].unique()
-            self._relevant_values_indexes[table, c] = RelevantValueIndex()
-            self._relevant_values_indexes[table, c].build(values)
+        self.build_relevant_values_indexes({table: columns})
+
+    def build_relevant_values_indexes(self, columns, max_workers=None):
+        """Builds the relevant value indexes of several tables in parallel, e.g. {"players": ["name", "position"]}."""
+        values = {(t, c): self.tables[t].get_values(c).unique() for t, cs in columns.items() for c in cs}
+        fingerprints = {f"{t}-{c}": self.tables[t].get_fingerprint(c) for t, c in values}
+        indexes = build_indexes({f"{t}-{c}": v for (t, c), v in values.items()}, self.index_dir,
+                                max_workers=max_workers, fingerprints=fingerprints)
+        for t, c in values:
+            self._relevant_values_indexes[t, c] = indexes[f"{t}-{c}"]
 
     def get_relevant_values(self, table, column, keywords="", num=10):
         if (table, column) in self._relevant_values_indexes:
             return self._relevant_values_indexes[table, column].get_relevant_values(*keywords, num=10)
-        return self.tables[table].data_frame[column][:num].tolist()
+        return self.tables[table].head(num, [column])[column].tolist()
 
     def has_relevant_values_index(self, table, column):
         return (table, column) in self._relevant_values_indexes
 
     def _link(self, table1, table2, column1, column2):
         """Links a tabular table to another table."""
-        table1.add_link(Link(table1, table2, column1, column2))
+        link = Link(table1, table2, column1, column2)
+        table1.add_link(link)
+        self._join_graph.add_link(link)
+
+    def get_join_columns(self, tables):
+        """Returns the (table, column) pairs of a minimal set of joins that connects the given tables."""
+        return self._join_graph.get_join_columns(tables)
 
     def link_image(self, tabular_table, image_table, column):
         """Links an tabular table to an image table."""
@@ -120,11 +300,28 @@ class Database():
                   self._tables[tabular_table2],
                   column1=column1, column2=column2 or column1)
 
+    def _cached_prompt(self, key, render):
+        """Returns a cached prompt fragment. Keys contain table versions, so changed tables miss the cache."""
+        if key in self._prompt_cache:
+            self._prompt_cache.move_to_end(key)
+            self.prompt_cache_counters["hits"] += 1
+            return self._prompt_cache[key]
+        self.prompt_cache_counters["misses"] += 1
+        result = self._prompt_cache[key] = render()
+        if len(self._prompt_cache) > PROMPT_CACHE_SIZE:
+            self._prompt_cache.popitem(last=False)
+        return result
+
     def describe(self):
         """Describes the database."""
+        key = ("describe", ) + tuple((t.name, t.version, len(t.links)) for t in self._tables.values())
+        return self._cached_prompt(key, self._describe)
+
+    def _describe(self):
         result = "The database contains the following tables:\n"
         for _, table in self._tables.items():
-            result += table.describe() + "\n"
+            key = ("describe_table", table.name, table.version, len(table.links))
+            result += self._cached_prompt(key, table.describe) + "\n"
         result += "\n"
         result += "A column with the IMAGE datatype stores images. "
         result += "A column with the TEXT datatype stores long text.\n"
@@ -132,46 +329,42 @@ class Database():
 
     def peek_table(self, table, num_rows=5, max_num_rows=10, columns=None, example_text=False):
         """Peeks at a table."""
-        df = table.data_frame
+        relevant_columns = self._get_relevant_columns(table)
+        key = ("peek", table.name, table.version, num_rows, max_num_rows, tuple(columns or ()), example_text,
+               self.peek_token_budget, relevant_columns)
+        return self._cached_prompt(key, lambda: self._peek_table(table, num_rows, max_num_rows, columns, example_text,
+                                                                 relevant_columns))
+
+    def _peek_table(self, table, num_rows, max_num_rows, columns, example_text, relevant_columns):
         datatypes = [table.get_datatype_for_column(c) for c in columns or table.get_columns()]
-        method = "key-value"
-        if columns:
-            df = df[columns]
-            method = "markdown"
-        ds_num_rows = len(df)
+        method = "markdown" if columns else "key-value"
+        ds_num_rows = table.num_rows
         if ds_num_rows > max_num_rows:
-            result =  self.serialize(df.head(num_rows), datatypes=datatypes, method=method, example_text=example_text)
+            result =  self.serialize(table.head(num_rows, columns or None), datatypes=datatypes, method=method,
+                                     example_text=example_text, relevant_columns=relevant_columns)
             if ds_num_rows > num_rows:
                 result += f"\n and {ds_num_rows - num_rows} more rows. \n"
         else:
-            result = self.serialize(df, datatypes=datatypes, method=method, example_text=example_text)
+            result = self.serialize(table.head(max_num_rows, columns or None), datatypes=datatypes, method=method,
+                                    example_text=example_text, relevant_columns=relevant_columns)
         return result
 
-    def serialize(self, df, datatypes, method="markdown", example_text=True):
-        df_orig = df
-        df = df.copy()
-        example_texts = {}
-        for c, dt, in zip(df.columns, datatypes):
-            if dt == "TEXT":
-                df[c] = df[c].apply(lambda _: "<TEXT>")
-                example_texts[c] = " ".join(df_orig[c].iloc[0].split()[:200]) + " ..."
-
-        result = ""
-        if method == "key-value":
-            result = []
-            for _, row in df.iterrows():
-                row_serialized = " | ".join(f"{c}: {v}" for c, v in zip(df.columns, row))
-                result.append(row_serialized)
-            result = "\n".join(result)
-        elif method == "markdown":
-            result = df.to_markdown()
-        else:
-            raise ValueError("Unknown serialization methods.")
+    def serialize(self, df, datatypes, method="markdown", example_text=True, relevant_columns=()):
+        """Serializes a data frame for a prompt, within the peek token budget if one is set."""
+        return self.serializer.serialize(df, datatypes, method=method, example_text=example_text,
+                                         token_budget=self.peek_token_budget, relevant_columns=relevant_columns)
 
-        if example_text and example_texts:
-            result += "\n\nExample texts for columns of TEXT datatype. Data-GPT is able to process these and to extract relevant information in structured form:\n" + \
-                "\n".join(f"Column '{k}': {v}" for k, v in example_texts.items())
-        return result
+    def set_relevant_columns(self, columns):
+        """Sets the (table, column) pairs relevant for the current query. Peeks keep these when shortened."""
+        self._relevant_columns = frozenset((t, c) for t, c in columns)
+
+    def _get_relevant_columns(self, table):
+        """Returns the relevant columns of a table, including those of the tables it has been derived from."""
+        names = set()
+        while table is not None:
+            names.add(table.name)
+            table = table.parent
+        return frozenset(c for t, c in self._relevant_columns if t in names)
 
     def peek(self, table_name, *args, **kwargs):
         """Peeks at a table."""
@@ -179,7 +372,17 @@ class Database():
 
     def sql(self, result_name, query):
         """Executes an SQL query on the database."""
-        result = sqldf(query, {k: v.data_frame for k, v in self.tables.items()})
+        tokens = set(re.findall(r"\w+", query.lower()))
+        self._pinned_tables = {n for n in self._working_set if n.lower() in tokens}  # must not spill each other
+        try:
+            for name in self._sql_engine.sync(query, self.tables):
+                if name in self._working_set:
+                    data = self._working_set[name].data_frame
+                    self._sql_bytes[name] = int(data.memory_usage(index=False, deep=True).sum())
+            self._enforce_memory_budget(keep=None)
+            result = self._sql_engine.query(query)
+        finally:
+            self._pinned_tables = set()
         cols = []
         remove = False
         for c in result.columns:
@@ -196,6 +399,8 @@ class Database():
         mentioned_tables = [n for n in mentioned_tables if n in self.tables]
         image_columns = tuple(c for d in mentioned_tables for c in self.get_table_by_name(d).image_columns
                               if c in result.columns)
+        for c in set(image_columns):  # SQLite returns plain paths
+            result[c] = result[c].astype("category")
         text_columns = tuple(c for d in mentioned_tables for c in self.get_table_by_name(d).text_columns
                              if c in result.columns)
         result = Table(result_name, result, f"Result of SQL query: {query}",
@@ -204,10 +409,23 @@ class Database():
 
     def get_column_values(self, table_name, column_name, force_datatype=None):
         """Gets the values of a column."""
+        self._check_column(table_name, column_name, force_datatype)
+        self._touch(table_name)
+        return self.tables[table_name].get_values(column_name).values
+
+    def read_column_values(self, table_name, column_name, force_datatype=None):
+        """Gets the values of a column without changing the working set, so it can be called from other threads.
+
+        Spilled tables are read from disk but stay spilled, and no table is spilled to make room.
+        """
+        self._check_column(table_name, column_name, force_datatype)
+        return self.tables[table_name].read_values(column_name).values
+
+    def _check_column(self, table_name, column_name, force_datatype):
         if table_name not in self.tables:
             raise ExecutionError(description=f"table {table_name} not found. "
                                  + self.alternatives(table_name, column_name, force_datatype))
-        if column_name not in self.tables[table_name].data_frame.columns:
+        if column_name not in self.tables[table_name].get_columns():
             raise ExecutionError(description=f"Column {column_name} not found in table {table_name}. "
                                  + self.alternatives(table_name, column_name, force_datatype))
 
@@ -218,30 +436,33 @@ class Database():
                                 f"but selected tool requires {force_datatype}. "
                                 " Consider choosing a different tool!"
                 )
-        return self.tables[table_name].data_frame[column_name].values
+
+    def get_fingerprint(self, table_name, column_name=None):
+        """Returns a content hash of a table or one of its columns, e.g. to key caches and persisted indexes."""
+        return self.get_table_by_name(table_name).get_fingerprint(column_name)
+
+    def get_version(self, table_name):
+        """Returns the version of a table, which increases whenever its data is replaced."""
+        return self.get_table_by_name(table_name).version
+
+    def get_datatypes(self):
+        """Returns the datatypes of the columns of all base tables."""
+        return {str(table.get_datatype_for_column(c)) for table in self._tables.values() for c in table.get_columns()}
 
     def get_column_datatype(self, table_name, column_name):
         """Gets the values of a column."""
         if table_name not in self.tables:
             raise ValueError(f"table {table_name} not found. "
                              + self.alternatives(table_name, column_name))
-        if column_name not in self.tables[table_name].data_frame.columns:
+        if column_name not in self.tables[table_name].get_columns():
             raise ValueError(f"Column {column_name} not found in table {table_name}. "
                              + self.alternatives(table_name, column_name))
         return self.tables[table_name].get_datatype_for_column(column_name)
 
     def alternatives(self, table_name, column_name=None, force_datatype=None, num_suggestions=3, thresh=0):
         """Returns a list of alternatives for a column."""
-        suggested = []
-        for table_similarity, table in ((fuzz.ratio(n, table_name), d) for n, d in self.tables.items()):
-            if column_name is None:
-                suggested.append((table_similarity, table.name))
-                continue
-
-            for column_similarity, column in ((fuzz.ratio(c, column_name), c) for c in table.data_frame.columns):
-                if force_datatype is None or force_datatype == table.get_datatype_for_column(column):
-                    suggested.append(((table_similarity + column_similarity), f"{table.name}.{column}"))
-        final_suggestions = [x for s, x in sorted(suggested)[::-1]  if s > thresh][:num_suggestions]
+        final_suggestions = self._suggestions.suggest(table_name, column_name, datatype=force_datatype,
+                                                      num=num_suggestions, thresh=thresh)
         if final_suggestions:
             return "Did you mean any of: " + ", " .join(final_suggestions)
         return ""
@@ -250,7 +471,7 @@ class Database():
         """Registers a tool."""
         if hasattr(tool, "on_ingest"):
             for table in self._tables.values():
-                tool.on_ingest(table, 0, len(table.data_frame))
+                tool.on_ingest(table, 0, table.num_rows)
         if hasattr(tool, "persist"):
             tool.persist()
 
@@ -1,54 +1,254 @@
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import re
+from pathlib import Path
+import shutil
+import uuid
+import numpy as np
 import pandas as pd
 
 
+logger = logging.getLogger(__name__)
+
+INDEX_PATH = Path(".indexes/")
+FORMAT_VERSION = 1
+ARRAYS = ("n_grams", "indptr", "indices", "idf", "norms")
+# forking a process with running threads (metrics server, model warm-up) can deadlock the workers
+START_METHOD = "forkserver"
+
+
 class RelevantValueIndex():
-    def __init__(self, n=5, padding=4):
-        self.map = None
-        self.values = set()
+    """Inverted n-gram index over the distinct values of a column.
+
+    The n-gram vocabulary is kept as a sorted array, so the position of an n-gram is its id.
+    The posting list of n-gram i are the value ids indices[indptr[i]:indptr[i + 1]] (CSR layout).
+    Values are ranked by BM25-weighted n-gram overlap with the keywords.
+    """
+
+    def __init__(self, n=5, padding=4, k1=1.2, b=0.75):
         self.n = n
         self.padding = padding
+        self.k1 = k1
+        self.b = b
+        self.values = np.array([], dtype=object)
+        self.n_grams = np.array([], dtype=f"<U{n}")
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.array([], dtype=np.int32)
+        self.idf = np.array([], dtype=np.float32)
+        self.norms = np.array([], dtype=np.float32)
+
+    @classmethod
+    def cached(cls, values, directory, name, **kwargs):
+        """Loads the index for these values from the directory, or builds and persists it if there is none."""
+        return build_indexes({name: values}, directory, **kwargs)[name]
+
+    @staticmethod
+    def get_path(directory, name, values, key=None):
+        """Returns the directory an index over these values is persisted in. The key defaults to their fingerprint."""
+        name = re.sub(r"[^\w-]", "_", name)
+        return Path(directory) / f"{name}-{key or fingerprint(values)}"
 
     def build(self, values):
-        values = pd.Series(values)
-        self.map = pd.DataFrame({"values": values, "n-grams": values.map(self.get_n_grams)})
-        self.map = self.map.explode("n-grams")
-        self.map = self.map.groupby("n-grams").agg(list)
-        self.values = set(values)
+        self.values = np.asarray(pd.Series(values, dtype=object).values)
+        vocabulary = {}
+        lengths = np.zeros(len(self.values), dtype=np.int64)
+        n_gram_ids = array("q")
+        for i, value in enumerate(self.values):
+            n_grams = self._get_n_grams(value)
+            lengths[i] = len(n_grams)
+            n_gram_ids.extend(vocabulary.setdefault(g, len(vocabulary)) for g in n_grams)
+        value_ids = np.repeat(np.arange(len(self.values), dtype=np.int32), lengths)
+
+        # sort the vocabulary, such that n-grams can be looked up using binary search
+        n_grams = np.array(list(vocabulary), dtype=f"<U{self.n}")
+        order = np.argsort(n_grams)
+        self.n_grams = n_grams[order]
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        n_gram_ids = rank[np.frombuffer(n_gram_ids, dtype=np.int64)] if len(n_gram_ids) else rank[:0]
+
+        order = np.argsort(n_gram_ids, kind="stable")
+        self.indices = value_ids[order]
+        document_frequency = np.bincount(n_gram_ids, minlength=len(self.n_grams))
+        self.indptr = np.zeros(len(self.n_grams) + 1, dtype=np.int64)
+        np.cumsum(document_frequency, out=self.indptr[1:])
+
+        num_values = len(self.values)
+        self.idf = np.log1p((num_values - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        # each n-gram occurs at most once per value, so the BM25 term weight only depends on the value length
+        avg_length = max(lengths.mean(), 1) if num_values else 1
+        self.norms = ((self.k1 + 1) / (1 + self.k1 * (1 - self.b + self.b * lengths / avg_length))).astype(np.float32)
+
+    def get_arrays(self):
+        return tuple(getattr(self, name) for name in ARRAYS)
+
+    def set_arrays(self, values, arrays):
+        self.values = np.asarray(pd.Series(values, dtype=object).values)
+        for name, a in zip(ARRAYS, arrays):
+            setattr(self, name, a)
 
     def get_relevant_values(self, *keywords, num=10):
-        n_grams = self.get_n_grams(*keywords)
-        n_grams = [x for x in n_grams if x in self.map.index]
-        values = self.map.loc[n_grams]
-        values = values.explode("values")["values"].value_counts(sort=True).index
-        values = values[:num].tolist()
-        values += self.get_remaining(values, num)
+        scores = self.score(*keywords)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > num:
+            candidates = candidates[np.argpartition(-scores[candidates], num - 1)[:num]]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))]
+        values = self.values[candidates].tolist()
+        values += self.get_remaining(candidates, num)
         return values
-    
-    def get_remaining(self, values, total_num):
-        values = set(values)
+
+    def score(self, *keywords):
+        """Computes the BM25 score of every value for the given keywords."""
+        query = np.array(self.get_n_grams(*keywords), dtype=str)
+        if len(query) == 0 or len(self.n_grams) == 0:
+            return np.zeros(len(self.values), dtype=np.float32)
+        positions = np.searchsorted(self.n_grams, query)
+        found = positions < len(self.n_grams)
+        found[found] = self.n_grams[positions[found]] == query[found]
+        positions = positions[found]
+        starts, ends = self.indptr[positions], self.indptr[positions + 1]
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        weights = np.repeat(self.idf[positions], lengths)
+        return np.bincount(self.indices[offsets], weights=weights, minlength=len(self.values)) * self.norms
+
+    def get_remaining(self, value_ids, total_num):
+        value_ids = set(value_ids.tolist())
         sample = list()
-        num = total_num - len(values)
-        for element in self.values:
-            if element not in values:
-                sample.append(element)
+        num = total_num - len(value_ids)
+        for i, element in enumerate(self.values):
             if len(sample) >= num:
                 break
+            if i not in value_ids:
+                sample.append(element)
         return sample
 
+    def save(self, path):
+        """Saves the index arrays and a metadata file to the given directory."""
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.tmp-{uuid.uuid4().hex}")
+        tmp_path.mkdir(parents=True)
+        for name in ARRAYS:
+            np.save(tmp_path / f"{name}.npy", getattr(self, name))
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump({"version": FORMAT_VERSION, "num_values": len(self.values), **self._params()}, f)
+        if path.exists():  # outdated version or concurrently written by another process
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def load(self, path, values, mmap=True):
+        """Loads the index from the given directory. Arrays are memory mapped and shared across processes."""
+        try:
+            with open(Path(path) / "meta.json") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if meta.pop("version") != FORMAT_VERSION or meta.pop("num_values") != len(values) or meta != self._params():
+            return False
+        for name in ARRAYS:
+            setattr(self, name, np.load(Path(path) / f"{name}.npy", mmap_mode="r" if mmap else None))
+        self.values = np.asarray(pd.Series(values, dtype=object).values)
+        return True
+
+    def _params(self):
+        return {"n": self.n, "padding": self.padding, "k1": self.k1, "b": self.b}
+
+    def memory_usage(self):
+        """Returns the number of bytes of the index arrays."""
+        return sum(a.nbytes for a in self.get_arrays())
+
     def get_n_grams(self, *keywords):
         result = set()
         for k in keywords:
             result |= self._get_n_grams(k)
         return list(result)
-    
+
     def _get_n_grams(self, keyword):
-        result = set()
         if pd.isna(keyword):
             keyword = ""
-        keyword = str(keyword) or ""
-        for i in range(-self.padding, len(keyword) - self.n + self.padding + 1):
-            pre_padding = "#" * max(-i, 0)
-            post_padding = "#" * max(i + self.n - len(keyword), 0)
-            n_gram = pre_padding + keyword[max(i, 0): max(i + self.n, 0)] + post_padding
-            result.add(n_gram)
-        return result
+        padded = "#" * self.padding + str(keyword) + "#" * self.padding
+        return {padded[i: i + self.n] for i in range(len(padded) - self.n + 1)}
+
+
+def fingerprint(values):
+    """Computes a content hash of the indexed values."""
+    hashes = pd.util.hash_pandas_object(pd.Series(values, dtype=object), index=False).values
+    return hashlib.blake2b(hashes.tobytes(), digest_size=16).hexdigest()
+
+
+def build_indexes(columns, directory=None, max_workers=None, fingerprints=None, **kwargs):
+    """Builds relevant value indexes for several columns, using a process pool if more than one needs building.
+
+    Args:
+        columns (dict): maps index names to the distinct values to index.
+        directory (Path): directory to load and persist indexes. None disables persistence.
+        max_workers (int): number of worker processes. Defaults to the number of cores.
+        fingerprints (dict): maps index names to fingerprints of the indexed columns to key persisted indexes by.
+    """
+    indexes, paths, missing = {}, {}, []
+    for name, values in columns.items():
+        indexes[name] = RelevantValueIndex(**kwargs)
+        if directory is not None:
+            paths[name] = RelevantValueIndex.get_path(directory, name, values, (fingerprints or {}).get(name))
+            if indexes[name].load(paths[name], values):
+                logger.debug(f"Loaded relevant value index {name} from {paths[name]}.")
+                continue
+        missing.append(name)
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(missing))
+    if max_workers <= 1:
+        for name in missing:
+            indexes[name].build(columns[name])
+    elif missing:
+        blocks = {name: _to_shared_memory(columns[name]) for name in missing}
+        try:
+            context = multiprocessing.get_context(START_METHOD)
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+                futures = {name: pool.submit(_build_from_shared_memory, blocks[name].name, len(columns[name]),
+                                             indexes[name]._params())
+                           for name in missing}
+                for name, future in futures.items():
+                    indexes[name].set_arrays(columns[name], future.result())
+        finally:
+            for block in blocks.values():
+                block.close()
+                block.unlink()
+
+    for name in missing:
+        if name in paths:
+            indexes[name].save(paths[name])
+    return indexes
+
+
+def _to_shared_memory(values):
+    """Writes the string keys of the values to shared memory: int64 byte offsets followed by the utf-8 data."""
+    keys = [("" if pd.isna(v) else str(v)).encode() for v in values]
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(k) for k in keys], out=offsets[1:])
+    block = shared_memory.SharedMemory(create=True, size=max(offsets.nbytes + int(offsets[-1]), 1))
+    block.buf[:offsets.nbytes] = offsets.tobytes()
+    block.buf[offsets.nbytes:offsets.nbytes + int(offsets[-1])] = b"".join(keys)
+    return block
+
+
+def _build_from_shared_memory(block_name, num_values, params):
+    """Worker: builds the index arrays for values stored in shared memory by _to_shared_memory."""
+    block = shared_memory.SharedMemory(name=block_name)
+    try:
+        header = (num_values + 1) * 8
+        offsets = np.frombuffer(bytes(block.buf[:header]), dtype=np.int64)
+        data = bytes(block.buf[header:header + int(offsets[-1])])
+    finally:
+        block.close()
+    index = RelevantValueIndex(**params)
+    index.build([data[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])])
+    return index.get_arrays()
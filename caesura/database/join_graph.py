@@ -0,0 +1,60 @@
+from collections import deque
+
+
+class JoinGraph():
+    """Catalog of join paths between tables.
+
+    Links are undirected edges. Shortest paths between all pairs of tables are recomputed with one BFS per table
+    whenever a link is added, which is rare compared to lookups.
+    """
+
+    def __init__(self):
+        self._edges = {}
+        self._paths = {}
+
+    def add_link(self, link):
+        """Adds a link between two tables. If two tables are linked several times, the first link is used."""
+        t1, t2 = link.table1.name, link.table2.name
+        self._edges.setdefault(t1, {}).setdefault(t2, (link.column1, link.column2))
+        self._edges.setdefault(t2, {}).setdefault(t1, (link.column2, link.column1))
+        self._paths = {}
+        for source in self._edges:
+            self._paths.update(self._shortest_paths(source))
+
+    def _shortest_paths(self, source):
+        """Returns the shortest paths from a table to all reachable tables as tuples of tables."""
+        paths = {source: (source, )}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            for neighbor in self._edges[table]:
+                if neighbor not in paths:
+                    paths[neighbor] = paths[table] + (neighbor, )
+                    queue.append(neighbor)
+        return {(source, target): path for target, path in paths.items() if target != source}
+
+    def get_path(self, table1, table2):
+        """Returns the tables on a shortest join path between two tables, or None if they are not connected."""
+        return self._paths.get((table1, table2))
+
+    def get_join_columns(self, tables):
+        """Returns the (table, column) pairs of the joins that connect the tables.
+
+        The joins form an approximate minimal Steiner tree: starting from one table, the closest remaining table is
+        repeatedly connected to the tree by its shortest path. Tables that are not connected start a new tree.
+        """
+        remaining = sorted(set(tables))
+        tree, result = set(), set()
+        while remaining:
+            candidates = [(len(self._paths[a, b]), a, b) for a in sorted(tree) for b in remaining if (a, b) in self._paths]
+            if not candidates:
+                tree.add(remaining.pop(0))
+                continue
+            _, a, b = min(candidates)
+            path = self._paths[a, b]
+            for t1, t2 in zip(path, path[1:]):
+                c1, c2 = self._edges[t1][t2]
+                result |= {(t1, c1), (t2, c2)}
+            tree |= set(path)
+            remaining = [t for t in remaining if t not in tree]
+        return result
@@ -0,0 +1,114 @@
+from pathlib import Path
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_PATH = Path(".manifests/")
+FORMAT_VERSION = 1
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+class ImageManifest():
+    """Persisted list of the files in an image directory with their size, modification time, inode and content hash.
+
+    The directory is only scanned again if its modification time changed, i.e. files were added, removed or renamed.
+    Content hashes are computed for the images that are looked up and reused as long as size and mtime match.
+    """
+
+    def __init__(self, directory: Path, manifest_dir: Path = MANIFEST_PATH):
+        self.directory = Path(directory)
+        key = hashlib.blake2b(str(self.directory.resolve()).encode(), digest_size=8).hexdigest()
+        self.path = Path(manifest_dir) / f"{self.directory.name}-{key}.json"
+        self.mtime_ns = None
+        self.files = {}
+        self.load()
+
+    def load(self):
+        """Loads the manifest from disk, if there is one."""
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("version") == FORMAT_VERSION:
+            self.mtime_ns = manifest["mtime_ns"]
+            self.files = manifest["files"]
+
+    def save(self):
+        """Writes the manifest to disk."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp-{uuid.uuid4().hex}")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": FORMAT_VERSION, "directory": str(self.directory), "mtime_ns": self.mtime_ns,
+                       "files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        """Rescans the directory if it changed since the manifest was written. Returns whether it was rescanned."""
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        if mtime_ns == self.mtime_ns:
+            return False
+        files = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files[entry.name] = self._get_entry(entry.stat(), self.files.get(entry.name))
+        self.files = dict(sorted(files.items()))
+        self.mtime_ns = mtime_ns
+        logger.info(f"Scanned {len(self.files)} images in {self.directory}.")
+        return True
+
+    def lookup(self, file_paths=()):
+        """Returns the paths of the images in the directory that the given paths point to.
+
+        A path matches an image if it has the same name and refers to the same file. If no paths are given,
+        all images in the directory are returned. Only the referenced paths are stat'ed.
+        """
+        changed = self.refresh()
+        if len(file_paths) == 0:
+            names = list(self.files)
+        else:
+            names = {}
+            for p in file_paths:
+                name = os.path.basename(p)
+                entry = self.files.get(name)
+                if entry is None or name in names:
+                    continue
+                try:
+                    stat = os.stat(p)
+                except OSError:
+                    continue
+                if (stat.st_dev, stat.st_ino) != (entry["device"], entry["inode"]):
+                    continue
+                names[name] = None
+                new_entry = self._get_entry(stat, entry)
+                changed |= new_entry != entry
+                self.files[name] = new_entry
+
+        for name in names:
+            if self.files[name]["hash"] is None:
+                self.files[name]["hash"] = self._hash(self.directory / name)
+                changed = True
+        if changed:
+            self.save()
+        return [str(self.directory / name) for name in names]
+
+    def _get_entry(self, stat, previous):
+        """Creates the manifest entry of a file. The hash is reused if the file did not change."""
+        unchanged = previous is not None and previous["size"] == stat.st_size \
+            and previous["mtime_ns"] == stat.st_mtime_ns
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "device": stat.st_dev, "inode": stat.st_ino,
+                "hash": previous["hash"] if unchanged else None}
+
+    def _hash(self, path):
+        """Computes the content hash of a file."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
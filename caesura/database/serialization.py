@@ -0,0 +1,147 @@
+from collections import Counter
+from functools import reduce
+import logging
+
+from caesura.utils import TEXT_PLACEHOLDER, render_image_placeholders
+
+
+logger = logging.getLogger(__name__)
+
+TOKEN_ENCODING = "cl100k_base"
+EXAMPLE_TEXT_WORDS = (200, 100, 50, 20)
+CELL_LIMITS = (None, 40, 15)
+COMPACT_METHODS = ("csv", "columns")
+_encoding = None
+
+
+def count_tokens(text):
+    """Counts the tokens of a text. Falls back to an estimate of four characters per token without tiktoken data."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:  # e.g. tiktoken not installed or encoding cannot be downloaded
+            logger.warning(f"Could not load token encoding {TOKEN_ENCODING}, estimating token counts: {e}")
+            _encoding = False
+    if _encoding is False:
+        return (len(text) + 3) // 4
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+class Serializer():
+    """Renders data frames for prompts, optionally within a token budget.
+
+    Without a budget, the requested method is used as is. With a budget, the first rendering that fits is chosen:
+    the requested method, then CSV and column-wise layouts, with increasingly truncated cells. If none fits, the
+    least relevant columns and then rows are dropped. Counters report the tokens saved against the unbudgeted rendering.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+
+    def serialize(self, df, datatypes, method="markdown", example_text=True, token_budget=None, relevant_columns=()):
+        """Serializes a data frame. TEXT and IMAGE cells are replaced by placeholders."""
+        datatypes = dict(zip(df.columns, datatypes))
+        text_columns = [c for c in df.columns if datatypes[c] == "TEXT"]
+        default = render(df, datatypes, method) + self._example_texts(df, text_columns, example_text, EXAMPLE_TEXT_WORDS[0])
+        if token_budget is None:
+            return default
+
+        default_tokens = count_tokens(default)
+        self.counters["tokens_default"] += default_tokens
+        if default_tokens <= token_budget:
+            self.counters["tokens_serialized"] += default_tokens
+            return default
+
+        result = self._fit(df, datatypes, method, token_budget, relevant_columns)
+        result_tokens = count_tokens(result)
+        for words in EXAMPLE_TEXT_WORDS[1:]:
+            examples = self._example_texts(df, text_columns, example_text, words)
+            if examples and result_tokens + count_tokens(examples) <= token_budget:
+                result, result_tokens = result + examples, result_tokens + count_tokens(examples)
+                break
+        self.counters["tokens_serialized"] += result_tokens
+        self.counters["tokens_saved"] += default_tokens - result_tokens
+        return result
+
+    def _fit(self, df, datatypes, method, token_budget, relevant_columns):
+        """Finds the most detailed rendering of the data frame that fits into the budget."""
+        relevant = [c for c in df.columns if c in relevant_columns]
+        columns = relevant + [c for c in df.columns if c not in relevant_columns]
+        df = df[columns]
+        for max_chars in CELL_LIMITS:
+            for m in (method, ) + tuple(x for x in COMPACT_METHODS if x != method):
+                result = render(df, datatypes, m, max_chars)
+                if count_tokens(result) <= token_budget:
+                    self.counters[f"method_{m}"] += 1
+                    return result
+
+        method, max_chars = COMPACT_METHODS[0], CELL_LIMITS[-1]
+        if len(df) == 0:  # no rows to drop, only the header is rendered
+            self.counters[f"method_{method}"] += 1
+            return render(df, datatypes, method, max_chars)
+        num_columns, num_rows = len(columns), len(df)
+        while True:
+            result = render(df.iloc[:num_rows, :num_columns], datatypes, method, max_chars)
+            omitted = len(columns) - num_columns
+            if omitted:
+                result += f"\n({omitted} less relevant columns omitted)"
+            if count_tokens(result) <= token_budget or (num_columns <= 1 and num_rows <= 1):
+                self.counters[f"method_{method}"] += 1
+                self.counters["truncated"] += 1
+                return result
+            if num_columns > max(len(relevant), 1):
+                num_columns -= 1
+            elif num_rows > 1:
+                num_rows -= 1
+            else:
+                num_columns -= 1 if num_columns > 1 else 0
+
+    def _example_texts(self, df, text_columns, example_text, num_words):
+        if not example_text or not text_columns or len(df) == 0:
+            return ""
+        example_texts = {c: " ".join(str(df[c].iloc[0]).split()[:num_words]) + " ..." for c in text_columns}
+        return "\n\nExample texts for columns of TEXT datatype. Data-GPT is able to process these and to extract relevant information in structured form:\n" + \
+            "\n".join(f"Column '{k}': {v}" for k, v in example_texts.items())
+
+
+def render(df, datatypes, method, max_chars=None):
+    """Renders the data frame without example texts. Cells are truncated to max_chars characters."""
+    if method == "markdown" and max_chars is None:
+        return _with_placeholders(df, datatypes).to_markdown()
+    cells = _cells(df, datatypes, max_chars)
+    if method == "key-value":
+        if len(cells.columns) == 0:
+            return ""
+        return "\n".join(reduce(lambda a, b: a + " | " + b, (f"{c}: " + cells.iloc[:, i]
+                                                             for i, c in enumerate(cells.columns))))
+    if method == "markdown":
+        return cells.to_markdown()
+    if method == "csv":
+        return cells.to_csv(index=False).strip()
+    if method == "columns":
+        return "\n".join(f"{c}: " + ", ".join(cells.iloc[:, i]) for i, c in enumerate(cells.columns))
+    raise ValueError("Unknown serialization methods.")
+
+
+def _with_placeholders(df, datatypes):
+    df = df.copy(deep=False)
+    for i, c in enumerate(df.columns):
+        if datatypes[c] == "IMAGE":
+            df.isetitem(i, render_image_placeholders(df.iloc[:, i]).values)
+        if datatypes[c] == "TEXT":
+            df.isetitem(i, [TEXT_PLACEHOLDER] * len(df))
+    return df
+
+
+def _cells(df, datatypes, max_chars):
+    """Converts all cells to strings, column by column."""
+    cells = _with_placeholders(df, datatypes)
+    for i, c in enumerate(cells.columns):
+        values = cells.iloc[:, i].astype(str)
+        if max_chars is not None and datatypes[c] not in ("IMAGE", "TEXT"):
+            too_long = values.str.len() > max_chars
+            values = values.where(~too_long, values.str.slice(0, max_chars) + "...")
+        cells.isetitem(i, values)
+    return cells
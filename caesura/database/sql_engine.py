@@ -0,0 +1,59 @@
+import re
+import sqlite3
+import logging
+import weakref
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class SqlEngine():
+    def __init__(self):
+        """Initializes a long-lived in-memory SQLite session.
+
+        Registered data frames are only weakly referenced, so replaced and dropped tables can be freed.
+        """
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self._registered = {}
+
+    def register(self, name, data_frame):
+        """Registers a data frame under the given name, replacing any previous table with that name."""
+        self._registered.pop(name, None)
+        data_frame.to_sql(name, self.connection, index=False, if_exists="replace")
+        self._registered[name] = weakref.ref(data_frame)
+        logger.debug(f"Registered table {name} in SQL engine.")
+
+    def drop(self, name):
+        """Drops a registered table."""
+        if self._registered.pop(name, None) is None:
+            return
+        self.connection.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+        logger.debug(f"Dropped table {name} from SQL engine.")
+
+    def is_registered(self, name, data_frame):
+        """Whether the given data frame is currently registered under the name."""
+        ref = self._registered.get(name)
+        return ref is not None and ref() is data_frame
+
+    def sync(self, query, tables):
+        """Makes sure all tables mentioned in the query are registered with their current data.
+
+        Like SQLite, table names are matched case-insensitively. Returns the names of the newly registered tables.
+        """
+        tokens = set(re.findall(r"\w+", query.lower()))
+        registered = []
+        for name, table in tables.items():
+            if name.lower() in tokens and not self.is_registered(name, table.data_frame):
+                self.register(name, table.data_frame)
+                registered.append(name)
+        return registered
+
+    def query(self, query):
+        """Executes an SQL query and returns the result as data frame."""
+        return pd.read_sql_query(query, self.connection)
+
+
+def _quote(name):
+    """Quotes an identifier for SQLite, e.g. a table name chosen by the model."""
+    return '"' + str(name).replace('"', '""') + '"'
@@ -0,0 +1,74 @@
+import numpy as np
+from rapidfuzz import fuzz, process
+
+
+class SuggestionIndex():
+    """Table and column names to suggest alternatives for misspelled names.
+
+    Column names are interned in a shared vocabulary, so a lookup scores every distinct name once and combines the
+    scores per table with numpy. Names no table uses anymore are dropped once they make up half of the vocabulary.
+    Scores are fuzz.ratio rounded to integers like fuzzywuzzy's.
+    """
+
+    def __init__(self):
+        self._vocabulary = {}
+        self._counts = []  # number of columns with each name
+        self._tables = {}
+
+    def add_table(self, table):
+        """Adds a table or replaces the table with the same name."""
+        self.remove_table(table.name)
+        columns = [str(c) for c in table.get_columns()]
+        ids = np.array([self._vocabulary.setdefault(c, len(self._vocabulary)) for c in columns], dtype=np.int64)
+        self._counts += [0] * (len(self._vocabulary) - len(self._counts))
+        for i in ids:
+            self._counts[i] += 1
+        datatypes = np.array([str(table.get_datatype_for_column(c)) for c in table.get_columns()], dtype=object)
+        self._tables[table.name] = (columns, ids, datatypes)
+
+    def remove_table(self, name):
+        """Removes a table."""
+        entry = self._tables.pop(name, None)
+        if entry is None:
+            return
+        for i in entry[1]:
+            self._counts[i] -= 1
+        if 2 * self._counts.count(0) > len(self._counts):
+            self._compact()
+
+    def _compact(self):
+        """Drops the names that are not used anymore and renumbers the remaining ones."""
+        names = [c for c, i in self._vocabulary.items() if self._counts[i] > 0]
+        counts = [self._counts[self._vocabulary[c]] for c in names]
+        self._vocabulary = {c: i for i, c in enumerate(names)}
+        self._counts = counts
+        self._tables = {name: (columns, np.array([self._vocabulary[c] for c in columns], dtype=np.int64), datatypes)
+                        for name, (columns, _, datatypes) in self._tables.items()}
+
+    def suggest(self, table_name, column_name=None, datatype=None, num=3, thresh=0):
+        """Returns the top names by similarity, as 'table' or 'table.column' if a column name is given."""
+        table_scores = _scores(table_name, list(self._tables))
+        if column_name is None:
+            labels, scores = list(self._tables), table_scores
+        else:
+            column_scores = _scores(column_name, list(self._vocabulary))
+            labels, scores = [], []
+            for table_score, (name, (columns, ids, datatypes)) in zip(table_scores, self._tables.items()):
+                selected = np.arange(len(columns)) if datatype is None else np.flatnonzero(datatypes == datatype)
+                labels += [f"{name}.{columns[i]}" for i in selected]
+                scores.append(table_score + column_scores[ids[selected]])
+            scores = np.concatenate(scores) if scores else np.zeros(0)
+
+        candidates = np.flatnonzero(scores > thresh)
+        if len(candidates) > num:  # keep ties with the last suggestion, these are broken by name
+            kth = np.partition(scores[candidates], len(candidates) - num)[len(candidates) - num]
+            candidates = candidates[scores[candidates] >= kth]
+        ranked = sorted(((scores[i], labels[i]) for i in candidates), reverse=True)
+        return [label for _, label in ranked[:num]]
+
+
+def _scores(query, choices):
+    """Scores the choices by similarity to the query. Empty queries match nothing."""
+    if not query or not choices:
+        return np.zeros(len(choices))
+    return np.rint(process.cdist([query], choices, scorer=fuzz.ratio)[0].astype(np.float64))
@@ -1,25 +1,139 @@
 from pathlib import Path
+import hashlib
+import itertools
+import logging
 import os
+import uuid
 from typing import List
+import numpy as np
 import pandas as pd
 
+from caesura.database.columnar import PARQUET_PATH, ParquetSource, csv_to_parquet
+from caesura.database.manifest import MANIFEST_PATH, ImageManifest
+
+logger = logging.getLogger(__name__)
+
+# Every assignment of data gets a new, globally increasing version.
+_versions = itertools.count(1)
+
+
 class Table():
-    def __init__(self, name:str, data: pd.DataFrame, description: str, text_columns=(), image_columns=(), parent=None):
-        """Initializes a table."""
+    def __init__(self, name:str, data: pd.DataFrame, description: str, text_columns=(), image_columns=(), parent=None,
+                 source=None):
+        """Initializes a table. Lazy tables pass no data but a ParquetSource, which is read on demand."""
         self.name = name
         self.description = description
         self.data_frame = data
+        self._source = source
         self.links = []
+        self.parent = parent
+        self._spill_counters = None
+        self._on_reload = None
         if parent is not None:
             text_columns = text_columns or parent.text_columns
             image_columns = image_columns or parent.image_columns
         self.text_columns = text_columns
         self.image_columns = image_columns
 
-    
+    @property
+    def data_frame(self):
+        """The data of the table. Spilled tables are transparently reloaded from disk."""
+        if self._data_frame is None and self._spill_path is not None:
+            self._reload()
+        elif self._data_frame is None and self._source is not None:
+            self._data_frame = self._source.read()
+            self._column_cache = {}
+            logger.debug(f"Materialized lazy table {self.name} from {self._source.path}.")
+        return self._data_frame
+
+    @data_frame.setter
+    def data_frame(self, data):
+        self._data_frame = data
+        self._spill_path = None
+        self._source = None
+        self._column_cache = {}
+        self._row_hashes = {}
+        self._fingerprints = {}
+        self.version = next(_versions)
+
+    @property
+    def is_lazy(self):
+        """Whether the data of the table has not been read from its source file yet."""
+        return self._data_frame is None and self._source is not None
+
+    @property
+    def num_rows(self):
+        """Number of rows of the table, read from the file metadata for lazy tables."""
+        data = self._data_frame
+        if data is not None:
+            return len(data)
+        return self._source.num_rows if self._spill_path is None else self._num_rows
+
+    @property
+    def dtypes(self):
+        """Pandas datatypes of the columns. Lazy and spilled tables are not loaded to get them."""
+        data = self._data_frame
+        if data is not None:
+            return data.dtypes
+        return self._source.dtypes if self._spill_path is None else self._spilled_dtypes
+
+    def head(self, num_rows, columns=None):
+        """Returns the first rows of the table. Lazy tables only read these rows."""
+        if self.is_lazy:
+            return self._source.head(num_rows, columns)
+        data = self.data_frame if columns is None else self.data_frame[columns]
+        return data.head(num_rows)
+
+    @property
+    def is_spilled(self):
+        """Whether the data of the table currently only resides on disk."""
+        return self._data_frame is None and self._spill_path is not None
+
+    def spill(self, directory: Path, counters=None, on_reload=None):
+        """Writes the table to disk and releases its data frame. on_reload is called once the table is reloaded."""
+        if self.is_spilled:
+            return
+        if self._spill_path is None:  # table not yet written to disk
+            path = Path(directory) / f"{uuid.uuid4().hex}.parquet"
+            try:
+                self._data_frame.to_parquet(path)
+            except Exception as e:  # e.g. pyarrow not installed or column with mixed types
+                logger.debug(f"Could not spill {self.name} to parquet, falling back to pickle: {e}")
+                path = path.with_suffix(".pkl")
+                self._data_frame.to_pickle(path)
+            self._spill_path = path
+        self._num_rows = len(self._data_frame)
+        self._spilled_dtypes = self._data_frame.dtypes
+        self._data_frame = None
+        self._spill_counters = counters
+        self._on_reload = on_reload
+        if counters is not None:
+            counters["spills"] += 1
+        logger.debug(f"Spilled table {self.name} to {self._spill_path}.")
+
+    def _reload(self):
+        """Reloads a spilled table from disk."""
+        if self._spill_path.suffix == ".parquet":
+            self._data_frame = pd.read_parquet(self._spill_path)
+        else:
+            self._data_frame = pd.read_pickle(self._spill_path)
+        if self._spill_counters is not None:
+            self._spill_counters["reloads"] += 1
+        logger.debug(f"Reloaded table {self.name} from {self._spill_path}.")
+        on_reload, self._on_reload = self._on_reload, None
+        if on_reload is not None:
+            on_reload(self)
+
+    def remove_spill_file(self):
+        """Removes the file the table has been spilled to. A table that is still spilled loses its data."""
+        if self._spill_path is not None:
+            self._spill_path.unlink(missing_ok=True)
+            self._spill_path = None
+
     def get_columns(self):
         """Gets the columns of a table."""
-        return self.data_frame.columns
+        data = self._data_frame
+        return data.columns if data is not None else self.dtypes.index
 
     def get_datatype_for_column(self, column_name):
         """Gets the datatype of a column."""
@@ -27,35 +141,95 @@ class Table():
             return "TEXT"
         if column_name in self.image_columns:
             return "IMAGE"
-        result = self.data_frame[column_name].dtype
+        result = self.dtypes[column_name]
         if result == "object":
             return "str"
         return result
 
     def get_values(self, column_name):
-        """Gets the values of a column."""
-        return self.data_frame[column_name]
-    
-    def create_image_table(name: str, path: Path, description: str, file_paths: List[str]):
+        """Gets the values of a column. Lazy tables only read the requested column."""
+        if not self.is_lazy:
+            return self.data_frame[column_name]
+        if column_name not in self._column_cache:
+            self._column_cache[column_name] = self._source.read([column_name])[column_name]
+        return self._column_cache[column_name]
+
+    def read_values(self, column_name):
+        """Gets the values of a column without loading, caching or spilling anything, e.g. from another thread."""
+        data = self._data_frame
+        if data is not None:
+            return data[column_name]
+        if self._spill_path is not None:
+            if self._spill_path.suffix == ".parquet":
+                return pd.read_parquet(self._spill_path, columns=[column_name])[column_name]
+            return pd.read_pickle(self._spill_path)[column_name]
+        cached = self._column_cache.get(column_name)
+        return cached if cached is not None else self._source.read([column_name])[column_name]
+
+    def derive(self, name, description, rows=None, new_columns=None):
+        """Derives a new table that references the unchanged columns of this table and only stores new ones.
+
+        Changed columns are replaced by new arrays instead of being written in place, so the parent is never modified.
+        """
+        new_columns = new_columns or {}
+        data = self.data_frame if rows is None else self.data_frame[rows]
+        data = _reference_columns(data)
+        for column, values in new_columns.items():
+            data[column] = _copy_if_shared(values, self._data_frame)
+        table = Table(name, data, description, parent=self)
+        # row hashes of unchanged columns are selected instead of recomputed
+        selection = slice(None) if rows is None else rows if isinstance(rows, slice) else np.asarray(rows)
+        table._row_hashes = {c: h[selection] for c, h in self._row_hashes.items() if c not in new_columns}
+        return table
+
+    def get_fingerprint(self, column_name=None):
+        """Returns a content hash of a column, or of the whole table if no column is given.
+
+        Column hashes are combined from cached per-row hashes. Tables read from a file are identified by the file.
+        """
+        if column_name is None:
+            columns = "\n".join(f"{c}:{t}:{self.get_fingerprint(c)}" for c, t in self.dtypes.items())
+            return _digest(columns.encode())
+        if column_name not in self._fingerprints:
+            if self._source is not None:
+                key = f"{self._source.path.name}:{column_name}".encode()
+            else:
+                key = self._get_row_hashes(column_name).tobytes()
+            self._fingerprints[column_name] = _digest(key)
+        return self._fingerprints[column_name]
+
+    def _get_row_hashes(self, column_name):
+        """Returns a 64-bit hash per row of the column."""
+        if column_name not in self._row_hashes:
+            values = self.data_frame[column_name]
+            self._row_hashes[column_name] = pd.util.hash_pandas_object(values, index=False).values
+        return self._row_hashes[column_name]
+
+    def memory_usage(self):
+        """Returns the number of bytes owned by this table and the number of bytes shared with its parent."""
+        if self.is_spilled:
+            return {"rows": self._num_rows, "own_bytes": 0, "shared_bytes": 0, "spilled": True}
+        own, shared = 0, 0
+        parent_data = self.parent._data_frame if self.parent is not None else None
+        for i, column in enumerate(self.data_frame.columns):
+            values = self.data_frame.iloc[:, i]
+            size = int(values.memory_usage(index=False, deep=True))
+            if parent_data is not None and column in parent_data.columns \
+                    and _shares_memory(values, parent_data[column]):
+                shared += size
+            else:
+                own += size
+        return {"rows": len(self.data_frame), "own_bytes": own, "shared_bytes": shared, "spilled": False}
+
+    def create_image_table(name: str, path: Path, description: str, file_paths: List[str],
+                           manifest_dir=MANIFEST_PATH):
         """Creates an image table."""
-        data = []
-        file_paths_dict = {}
-        for p in file_paths:  # files in table
-            p = Path(p)
-            file_paths_dict[p.name] = file_paths_dict.get(p.name, []) + [p]
-        for img_path in os.listdir(path):  # files in dir
-            full_path = Path(path) / img_path
-
-            # Only add rows where image path is in table and image file exists
-            if full_path.name not in file_paths_dict:
-                continue
-            if file_paths_dict and not any(Path.samefile(full_path, Path(p)) for p in file_paths_dict[full_path.name]):
-                continue
-            data.append({"img_path": str(full_path), "image": f"<IMAGE stored at '{full_path}'>"})
-        data = pd.DataFrame(data)
+        # Only add rows where image path is in table and image file exists
+        img_paths = ImageManifest(path, manifest_dir).lookup(file_paths)
+        data = pd.DataFrame({"img_path": pd.Series(img_paths, dtype=object), "image": pd.Categorical(img_paths)})
         return Table(name, data, description, image_columns=("image",))
 
-    def create_text_table(name: str, path: Path, description: str):
+    def create_text_table(name: str, path: Path, description: str, lazy=False, cache_dir=PARQUET_PATH):
         """Creates a text table."""
         data = []
         if Path(path).is_dir():
@@ -64,28 +238,75 @@ class Table():
                     data.append({"txt_path": str(Path(path) / txt_path), "text": f.read()})
             data = pd.DataFrame(data)
             return Table(name, data, description, text_columns=("text",))
+        source = Table._create_source(path, cache_dir) if lazy else None
+        if source is not None:
+            return Table(name, None, description, text_columns=(source.columns[-1],), source=source)
         else:
             data = pd.DataFrame(pd.read_csv(path))
             return Table(name, data, description, text_columns=(data.columns[-1],))
 
-    def create_tabular_table(name: str, path: Path, description: str, path_columns=()):
+    def create_tabular_table(name: str, path: Path, description: str, path_columns=(), lazy=False,
+                             cache_dir=PARQUET_PATH):
         """Creates a tabular table."""
+        source = Table._create_source(path, cache_dir, path_columns) if lazy else None
+        if source is not None:
+            return Table(name, None, description, source=source)
         data = pd.read_csv(path)
         for p in path_columns:
             data[p] = data[p].apply(lambda x: str(Path(path).parent / x))
         data = pd.DataFrame(data)
         return Table(name, data, description)
 
+    def _create_source(path, cache_dir, path_columns=()):
+        """Converts a CSV file to a Parquet file for lazy loading. Returns None if the conversion fails."""
+        try:
+            return ParquetSource(csv_to_parquet(path, cache_dir, path_columns))
+        except Exception as e:  # e.g. column with mixed types
+            logger.warning(f"Could not convert {path} to parquet, loading it eagerly: {e}")
+            return None
+
     def describe(self, skip_minus=False):
         """Describes the table."""
         special_cols = {**{img_column: "IMAGE" for img_column in self.image_columns},
                         **{txt_column: "TEXT" for txt_column in self.text_columns}}
         column_string = {str(c): str(special_cols.get(c, t if t != 'object' else 'str'))
-                         for c, t in zip(self.data_frame.columns, self.data_frame.dtypes)}
-        return f" {'' if skip_minus else '- '}{self.name} = table(num_rows={len(self.data_frame)}, columns=" \
-               f"{column_string}, primary_key='{self.data_frame.columns[0]}', " \
+                         for c, t in self.dtypes.items()}
+        return f" {'' if skip_minus else '- '}{self.name} = table(num_rows={self.num_rows}, columns=" \
+               f"{column_string}, primary_key='{self.get_columns()[0]}', " \
                f"description='{self.description}', foreign_keys={self.links})".replace("{", "[").replace("}", "]")
 
     def add_link(self, link):
         """Adds a link to the table."""
-        self.links.append(link)
\ No newline at end of file
+        self.links.append(link)
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _reference_columns(data):
+    """Builds a new data frame that references the columns of the given one without copying them."""
+    if data.shape[1] == 0:
+        return pd.DataFrame(index=data.index)
+    return pd.concat([data.iloc[:, i] for i in range(data.shape[1])], axis=1, copy=False)
+
+
+def _copy_if_shared(values, data):
+    """Copies values that are backed by a column of the data frame, so that they can be modified independently."""
+    if isinstance(values, pd.Series) and any(_shares_memory(values, data.iloc[:, i]) for i in range(data.shape[1])):
+        return values.copy()
+    return values
+
+
+def _buffer(values):
+    """Returns the array backing a column. Categorical columns are identified by their codes."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy(copy=False)
+    return values.to_numpy(copy=False)
+
+
+def _shares_memory(values, other):
+    """Checks whether two columns are backed by the same buffer."""
+    if isinstance(other, pd.DataFrame):  # duplicate column names
+        return False
+    return np.may_share_memory(_buffer(values), _buffer(other))
@@ -0,0 +1,172 @@
+from collections import Counter, defaultdict
+from concurrent.futures import Future
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+import re
+import sqlite3
+import threading
+import time
+
+from caesura.context import current_phase
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_PATH = Path(".llm_cache.db")
+MAX_ENTRIES = 100_000
+TTL_SECONDS = 30 * 24 * 60 * 60
+EVICT_EVERY = 100
+# content that changes between otherwise identical runs and should not influence the cache key
+VOLATILE_PATTERNS = (
+    (re.compile(r"\bat 0x[0-9a-fA-F]+"), "at 0x"),
+    (re.compile(r"\d{4}-\d{2}-\d{2}[ _T]\d{2}[:-]\d{2}[:-]\d{2}(\.\d+)?"), "<TIMESTAMP>"),
+    (re.compile(r"\s+"), " "),
+)
+
+
+def normalize(text):
+    """Normalizes a prompt for the cache key: whitespace is collapsed and volatile content is masked."""
+    for pattern, replacement in VOLATILE_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text.strip()
+
+
+class LLMCache():
+    """Cache for LLM responses in SQLite, shared by concurrent threads and processes.
+
+    Entries are namespaced by phase and model. The database runs in WAL mode, so parallel experiment runs can read
+    while one of them writes. Entries expire after ttl seconds, and the least recently used ones are evicted beyond
+    max_entries. Identical requests that are in flight at the same time are sent only once.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.counters = defaultdict(Counter)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._num_puts = 0
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS responses (namespace TEXT, key TEXT, response TEXT, "
+                         "created REAL, last_used REAL, PRIMARY KEY (namespace, key))")
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def _connection(self):
+        """Returns the connection of the current thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get_key(self, model_name, prompts, **params):
+        """Returns the namespace and key of a request."""
+        namespace = f"{current_phase.get() or 'default'}/{model_name}"
+        text = "\n".join(f"{type(p).__name__}: {normalize(p.content)}" for p in prompts)
+        text += "\n" + repr(sorted(params.items()))
+        return namespace, hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def get(self, namespace, key):
+        """Returns the cached response or None."""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute("SELECT response, created FROM responses WHERE namespace = ? AND key = ?",
+                               (namespace, key)).fetchone()
+            if row is not None and (self.ttl is None or row[1] >= now - self.ttl):
+                conn.execute("UPDATE responses SET last_used = ? WHERE namespace = ? AND key = ?", (now, namespace, key))
+                return row[0]
+        return None
+
+    def put(self, namespace, key, response):
+        """Stores a response and evicts expired and least recently used entries from time to time."""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (namespace, key, response, now, now))
+        with self._lock:
+            self._num_puts += 1
+            evict = self._num_puts % EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Removes expired entries and the least recently used ones beyond max_entries."""
+        with self._connection() as conn:
+            if self.ttl is not None:
+                conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl, ))
+            if self.max_entries is not None:
+                conn.execute("DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY last_used DESC "
+                             "LIMIT -1 OFFSET ?)", (self.max_entries, ))
+
+    def _lookup(self, namespace, key):
+        """Returns the cached response, a future of an identical request in flight, or a future to complete."""
+        phase = namespace.split("/")[0]
+        response = self.get(namespace, key)
+        if response is not None:
+            self.counters[phase]["hits"] += 1
+            return response, None, False
+        with self._lock:
+            if (namespace, key) in self._in_flight:
+                self.counters[phase]["coalesced"] += 1
+                return None, self._in_flight[namespace, key], False
+            future = self._in_flight[namespace, key] = Future()
+        response = self.get(namespace, key)  # an identical request may have completed since the first check
+        if response is not None:
+            self._finish(namespace, key)
+            future.set_result(response)
+            self.counters[phase]["hits"] += 1
+            return response, None, False
+        self.counters[phase]["misses"] += 1
+        return None, future, True
+
+    def _finish(self, namespace, key):
+        """Removes a request from the requests in flight."""
+        with self._lock:
+            del self._in_flight[namespace, key]
+
+    def _complete(self, namespace, key, future, compute):
+        """Computes and caches a response. The request stays in flight until its response has been cached."""
+        try:
+            response = compute()
+            self.put(namespace, key, response)
+        except BaseException as e:
+            self._finish(namespace, key)
+            future.set_exception(e)
+            raise e
+        self._finish(namespace, key)
+        future.set_result(response)
+        return response
+
+    def lookup(self, namespace, key, compute):
+        """Returns the cached response, or computes and caches it. compute returns the response as a string."""
+        response, future, owner = self._lookup(namespace, key)
+        if response is not None:
+            return response
+        if not owner:
+            return future.result()
+        return self._complete(namespace, key, future, compute)
+
+    async def alookup(self, namespace, key, compute):
+        """Async variant of lookup. compute is a coroutine function."""
+        response, future, owner = self._lookup(namespace, key)
+        if response is not None:
+            return response
+        if not owner:
+            return await asyncio.wrap_future(future)
+        try:
+            response = await compute()
+        except BaseException as e:
+            self._finish(namespace, key)
+            future.set_exception(e)
+            raise e
+        return self._complete(namespace, key, future, lambda: response)
+
+    def get_stats(self):
+        """Returns hits, misses, coalesced requests and the share of requests that were not sent, per phase."""
+        return {phase: {**c, "hit_rate": (c["hits"] + c["coalesced"]) / max(c["hits"] + c["misses"] + c["coalesced"], 1)}
+                for phase, c in self.counters.items()}
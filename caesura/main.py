@@ -1,17 +1,13 @@
 from pathlib import Path
-import langchain
 import logging
-from caesura.model import MyOpenAI
-from caesura.phases import PlanningPhase, DiscoveryPhase, MappingPhase, MappingPhase
-from langchain.cache import SQLiteCache
-from caesura.phases.base_phase import PhaseList
-from caesura.phases.runner import RunnerPhase
+import threading
+from caesura.llm_cache import LLM_CACHE_PATH, LLMCache
+from caesura.metrics import METRICS_FILE, metrics
 from caesura.scenarios import get_database
-from caesura.tools import ImageSelectTool, SqlTool, TransformTool, VisualQATool, PlottingTool
-from caesura.tools.noop import NoopTool
-from caesura.tools.text_qa import TextQATool
+from caesura.tracing import TRACE_FILE, start_trace, stop_trace
+
+# langchain, the LLM clients, phases and tools are imported where they are used, which keeps startup fast
 
-langchain.llm_cache = SQLiteCache(database_path=".langchain.db")
 logger = logging.getLogger(__name__)
 
 
@@ -27,11 +23,15 @@ MAX_NUM_ERRORS = {
 }
 
 class Caesura():
-    def __init__(self, database, model_name="gpt-3.5-turbo-0613", interactive=True, log_path=None):
+    def __init__(self, database, model_name="gpt-3.5-turbo-0613", interactive=True, log_path=None,
+                 cache_path=LLM_CACHE_PATH, replay_path=None, trace=False):
         self.database = database
         self.interactive = interactive
         self.working_memory = dict()
-        self.llm = MyOpenAI(temperature=0, model_name=model_name, max_tokens=1024, logging_dir=log_path or ".")
+        self.llm_cache = LLMCache(cache_path) if cache_path is not None and replay_path is None else None
+        self.replay_path = replay_path
+        self.trace = trace
+        self.llm = self.create_llm(model_name, temperature=0, logging_dir=log_path or ".")
         self.phases = list()
         self.tools = list()
         self.max_num_tries = MAX_NUM_RETRIES[model_name]
@@ -44,6 +44,17 @@ class Caesura():
         self.setup_tools()
         self.setup_phases()
 
+    def create_llm(self, model_name, temperature, **kwargs):
+        """Creates the LLM, which replays a recorded trace if a replay path is given."""
+        from caesura.model import MyOpenAI
+        from caesura.replay import ReplayLLM
+        if self.replay_path is not None and isinstance(getattr(self, "llm", None), ReplayLLM):
+            return self.llm.continued(temperature=temperature)
+        if self.replay_path is not None:
+            return ReplayLLM(self.replay_path, temperature=temperature, model_name=model_name, max_tokens=1024, **kwargs)
+        return MyOpenAI(temperature=temperature, model_name=model_name, max_tokens=1024, cache=self.llm_cache,
+                        streaming=True, **kwargs)
+
     def setup_logging(self):
         if self.log_path is not None:
             for handler in logging.root.handlers:
@@ -56,6 +67,9 @@ class Caesura():
             logging.root.addHandler(self.file_handler)
 
     def setup_tools(self):
+        from caesura.tools import ImageSelectTool, SqlTool, TransformTool, VisualQATool, PlottingTool
+        from caesura.tools.noop import NoopTool
+        from caesura.tools.text_qa import TextQATool
         self.tools = list()
         self.tools.append(ImageSelectTool(self.database))
         self.tools.append(VisualQATool(self.database))
@@ -67,7 +81,24 @@ class Caesura():
         for tool in self.tools:
             self.database.register_tool(tool)
 
+    def warm_up(self):
+        """Loads the models of the tools the database's datatypes call for, while the first phases talk to the LLM."""
+        datatypes = self.database.get_datatypes()
+        tools = [t for t in self.tools if t.datatype in datatypes]
+        if tools:
+            threading.Thread(target=self._warm_up, args=(tools, ), daemon=True, name="warm-up").start()
+
+    def _warm_up(self, tools):
+        for tool in tools:
+            try:
+                tool.warm_up()
+            except Exception as e:  # the tool loads its models again on first use and reports the error then
+                logger.warning(f"Warm-up of {tool.name} failed: {e}", exc_info=True)
+
     def setup_phases(self):
+        from caesura.phases import PlanningPhase, DiscoveryPhase, MappingPhase
+        from caesura.phases.base_phase import PhaseList
+        from caesura.phases.runner import RunnerPhase
         self.phases = PhaseList(
             DiscoveryPhase(llm=self.llm, database=self.database, max_num_errors=self.max_num_errors),
             PlanningPhase(llm=self.llm, database=self.database, max_num_errors=self.max_num_errors),
@@ -78,6 +109,26 @@ class Caesura():
 
     def run(self, query):
         query = query.strip().strip(".")
+        metrics_snapshot = metrics.snapshot()
+        if self.trace:
+            start_trace()
+        try:
+            self.warm_up()
+            final_plan, final_result, error = self._run(query)
+        finally:  # also when an error is raised in interactive mode
+            if self.log_path is not None:
+                metrics.save(Path(self.log_path) / METRICS_FILE, metrics_snapshot)
+            if self.trace:
+                stop_trace(Path(self.log_path) / TRACE_FILE if self.log_path is not None else None)
+        if error is not None:
+            logging.root.removeHandler(self.file_handler)
+            if self.interactive:
+                raise error
+            return
+        self.log_final_plan(query, final_plan, final_result)
+
+    def _run(self, query):
+        """Runs the phases until they succeed or max_num_tries is reached. Returns the plan, result and last error."""
         error = None
         num_tries = 0
         final_plan = None
@@ -97,21 +148,14 @@ class Caesura():
                 num_tries += 1
                 final_result = self.database.final_result()
                 self.database.clear_working_set()
-
-        if error is not None:
-            logging.root.removeHandler(self.file_handler)
-            if self.interactive:
-                raise error
-            return
-        self.log_final_plan(query, final_plan, final_result)
+        return final_plan, final_result, error
 
     def restart_after_error(self, e):
         logger.warning(e, exc_info=True)
         self.setup_tools()
         self.setup_phases()
         error = e
-        self.llm = MyOpenAI(temperature=self.llm.temperature + 0.2,
-                            model_name=self.llm.model_name, max_tokens=1024)
+        self.llm = self.create_llm(self.llm.model_name, temperature=self.llm.temperature + 0.2)
         return error
 
     def log_final_plan(self, query, final_plan, final_result):
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+from caesura.context import current_phase
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = "metrics.json"
+
+
+class Metrics():
+    """Registry of counters and timers, labeled like Prometheus metrics.
+
+    Timers record the number of observations and their sum. Both only grow, so the metrics of a single query are the
+    difference of two snapshots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._timers = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name, value=1, **labels):
+        """Increments a counter."""
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, name, seconds, **labels):
+        """Records a duration."""
+        with self._lock:
+            timer = self._timers[_key(name, labels)]
+            timer[0] += 1
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Times the block. Exceptions are counted in <name>_errors, labeled with the error type."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.inc(f"{name}_errors", error=type(e).__name__, **labels)
+            raise e
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """Returns all metrics as a JSON serializable dict."""
+        with self._lock:
+            return {
+                "counters": {_format(k): v for k, v in sorted(self._counters.items())},
+                "timers": {_format(k): {"count": c, "sum": s} for k, (c, s) in sorted(self._timers.items())},
+            }
+
+    def since(self, snapshot):
+        """Returns the metrics recorded after a snapshot was taken."""
+        current = self.snapshot()
+        counters = {k: v - snapshot["counters"].get(k, 0) for k, v in current["counters"].items()}
+        timers = {k: {"count": v["count"] - snapshot["timers"].get(k, {}).get("count", 0),
+                      "sum": v["sum"] - snapshot["timers"].get(k, {}).get("sum", 0.0)}
+                  for k, v in current["timers"].items()}
+        return {"counters": {k: v for k, v in counters.items() if v},
+                "timers": {k: v for k, v in timers.items() if v["count"]}}
+
+    def to_prometheus(self):
+        """Renders all metrics in the Prometheus text format."""
+        with self._lock:
+            counters, timers = dict(self._counters), {k: tuple(v) for k, v in self._timers.items()}
+        lines = []
+        for name in sorted({k[0] for k in counters}):
+            lines.append(f"# TYPE caesura_{name}_total counter")
+            lines += [f"{_format(k, 'caesura_', '_total')} {v}" for k, v in sorted(counters.items()) if k[0] == name]
+        for name in sorted({k[0] for k in timers}):
+            lines.append(f"# TYPE caesura_{name} summary")
+            for k, (count, total) in sorted(timers.items()):
+                if k[0] == name:
+                    lines.append(f"{_format(k, 'caesura_', '_count')} {count}")
+                    lines.append(f"{_format(k, 'caesura_', '_sum')} {total}")
+        return "\n".join(lines) + "\n"
+
+    def save(self, path, snapshot=None):
+        """Writes the metrics since the snapshot, or all metrics, as JSON."""
+        with open(path, "w") as f:
+            json.dump(self.since(snapshot) if snapshot is not None else self.snapshot(), f, indent=2)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves the metrics in the Prometheus text format from a background thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                data = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+        logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+        return server
+
+
+def _key(name, labels):
+    labels.setdefault("phase", current_phase.get() or "none")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format(key, prefix="", suffix=""):
+    name, labels = key
+    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{prefix}{name}{suffix}{{{labels}}}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# metrics of the process
+metrics = Metrics()
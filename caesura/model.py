@@ -1,11 +1,17 @@
+from collections import OrderedDict
+from contextvars import ContextVar
 import datetime
 from pathlib import Path
-import time
 import logging
 from typing import Any
 from openai import Completion
+from openai.error import RateLimitError
 from langchain.chat_models import ChatOpenAI
-from langchain.prompts.chat import ChatPromptTemplate
+from langchain.schema import AIMessage, ChatGeneration, ChatResult, get_buffer_string
+
+from caesura.metrics import metrics
+from caesura.rate_limit import get_rate_limiter
+from caesura.tracing import span
 
 
 logger = logging.getLogger(__name__)
@@ -30,53 +36,178 @@ MAX_NUM_TOKENS_HARD = {
     "gpt-4-0613": 8_192 - 1024
 }
 
-MULTIPLIER = 0.5
-REDUCE_MULTIPLIER = False
+PROMPT_OVERHEAD_TOKENS = 100
+MESSAGE_TOKEN_CACHE_SIZE = 4096
+ERROR_PREFIX = "Something went wrong"
+
+# prompt tokens and number of attempts of the request that is currently sent, per thread / asyncio task
+_request = ContextVar("request", default=None)
 
 
 class MyOpenAI(ChatOpenAI):
-    last_call = 0
     logging_dir: Path = None
     start_time = datetime.datetime.now()
     call_counter = 0
     max_num_tokens_soft: int = 0
     max_num_tokens_hard: int = 0
-    max_rpm: int = 0
-    max_tpm: int = 0
+    rate_limiter: Any = None
+    message_tokens: Any = None
+    num_evicted_tokens: int = 0
+    cache: Any = None
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        with metrics.timer("llm_call_seconds", model=self.model_name), span("llm_call", "llm", model=self.model_name):
+            prompts, num_tokens = self._prepare(prompts)
+            result, sent = self._generate_prepared(prompts, num_tokens, stop, run_manager, **kwargs)
+        self._record_call(num_tokens, result, sent)
+        self._log_call(prompts, result)
+        return result
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        with metrics.timer("llm_call_seconds", model=self.model_name), span("llm_call", "llm", model=self.model_name):
+            prompts, num_tokens = self._prepare(prompts)
+            result, sent = await self._agenerate_prepared(prompts, num_tokens, stop, run_manager, **kwargs)
+        self._record_call(num_tokens, result, sent)
+        self._log_call(prompts, result)
+        return result
+
+    def _generate_prepared(self, prompts, num_tokens, stop, run_manager, **kwargs):
+        """Returns the response and whether it was requested from the API."""
+        if self.cache is not None:
+            sent = []
+
+            def send():
+                sent.append(True)
+                return self._send(prompts, num_tokens, stop, run_manager, **kwargs).generations[0].text
+            text = self.cache.lookup(*self._cache_key(prompts, stop), send)
+            if run_manager and not sent:  # responses from the cache are streamed as a single token
+                run_manager.on_llm_new_token(text)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))]), bool(sent)
+        return self._send(prompts, num_tokens, stop, run_manager, **kwargs), True
+
+    async def _agenerate_prepared(self, prompts, num_tokens, stop, run_manager, **kwargs):
+        if self.cache is not None:
+            sent = []
+
+            async def send():
+                sent.append(True)
+                return (await self._asend(prompts, num_tokens, stop, run_manager, **kwargs)).generations[0].text
+            text = await self.cache.alookup(*self._cache_key(prompts, stop), send)
+            if run_manager and not sent:
+                await run_manager.on_llm_new_token(text)
+            return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))]), bool(sent)
+        return await self._asend(prompts, num_tokens, stop, run_manager, **kwargs), True
+
+    def _record_call(self, num_tokens, result, sent):
+        metrics.inc("llm_calls", model=self.model_name, source="api" if sent else "cache")
+        if sent:
+            metrics.inc("llm_prompt_tokens", num_tokens, model=self.model_name)
+            metrics.inc("llm_completion_tokens", self.get_num_tokens(result.generations[0].text), model=self.model_name)
 
-    def _generate(self, prompts, *args, **kwargs):
+    def _send(self, prompts, num_tokens, stop, run_manager, **kwargs):
+        request = {"tokens": num_tokens, "attempts": 0, "interrupted": False}
+        token = _request.set(request)
+        try:
+            logger.debug(f"Request: {prompts}")
+            while True:
+                try:
+                    result = super()._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+                    break
+                except Exception as e:
+                    if not self._retry_interrupted(request, e):
+                        raise e
+            logger.debug(f"Response: {result}")
+        finally:
+            _request.reset(token)
+        return result
+
+    async def _asend(self, prompts, num_tokens, stop, run_manager, **kwargs):
+        request = {"tokens": num_tokens, "attempts": 0, "interrupted": False}
+        token = _request.set(request)
+        try:
+            logger.debug(f"Request: {prompts}")
+            while True:
+                try:
+                    result = await super()._agenerate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+                    break
+                except Exception as e:
+                    if not self._retry_interrupted(request, e):
+                        raise e
+            logger.debug(f"Response: {result}")
+        finally:
+            _request.reset(token)
+        return result
+
+    def _retry_interrupted(self, request, e):
+        """Whether to send a request again because its response stream broke off. langchain only retries errors
+        raised before the stream starts."""
+        if not request["interrupted"] or request["attempts"] > self.max_retries:
+            return False
+        request["interrupted"] = False
+        logger.warning(f"Response stream interrupted, sending the request again: {e}")
+        return True
+
+    def _cache_key(self, prompts, stop):
+        return self.cache.get_key(self.model_name, prompts, temperature=self.temperature, max_tokens=self.max_tokens,
+                                  stop=stop)
+
+    def _prepare(self, prompts):
+        """Sets up the client and shortens the prompts to fit into the context window."""
         if not isinstance(self.client, MyClient):
+            self.rate_limiter = get_rate_limiter(self.model_name, MAX_RPM[self.model_name], MAX_TPM[self.model_name])
+            self.client = MyClient(self.client, self)
+        return self._shorten(prompts)
+
+    def _shorten(self, prompts):
+        """Evicts messages and chops the system prompt until the prompts fit. Returns them and their length."""
+        if not self.max_num_tokens_hard:
             self.max_num_tokens_hard = MAX_NUM_TOKENS_HARD[self.model_name]
             self.max_num_tokens_soft = MAX_NUM_TOKENS_SOFT[self.model_name]
-            self.max_rpm = int(MAX_RPM[self.model_name] * MULTIPLIER)
-            self.max_tpm = int(MAX_TPM[self.model_name] * MULTIPLIER)
+        counts = [self.get_message_len(p) for p in prompts]
+        num_tokens = sum(counts) + PROMPT_OVERHEAD_TOKENS
+        if num_tokens > self.max_num_tokens_soft and len(prompts) > 3:
+            evicted = set()
+            for i in self._eviction_order(prompts):
+                if num_tokens <= self.max_num_tokens_soft:
+                    break
+                evicted.add(i)
+                num_tokens -= counts[i]
+            self.num_evicted_tokens += sum(counts[i] for i in evicted)
+            metrics.inc("llm_evicted_tokens", sum(counts[i] for i in evicted), model=self.model_name)
+            logger.info(f"Evicted {len(evicted)} messages with {sum(counts[i] for i in evicted)} tokens from the prompt.")
+            prompts = [p for i, p in enumerate(prompts) if i not in evicted]
 
-            self.client = MyClient(self.client, self)
-
-        num_tokens = self.get_prompt_len(prompts)
-        while num_tokens > self.max_num_tokens_soft and len(prompts) > 3:
-            prompts = prompts[:2] + prompts[3:]
+        if num_tokens > self.max_num_tokens_hard:
+            prompts[0].content = self._chop(prompts[0], self.get_message_len(prompts[0]) - (num_tokens - self.max_num_tokens_hard))
             num_tokens = self.get_prompt_len(prompts)
+        return prompts, num_tokens
 
-        while num_tokens > self.max_num_tokens_hard:
-                prompts[0].content = prompts[0].content[100:]
-                if prompts[0].content == "":
-                    raise ValueError("Prompt too long. No more possibility to shorten it. Abort!")
-                num_tokens = self.get_prompt_len(prompts)
-
-        current_call = time.time()
-        delta = current_call - self.last_call
+    def _eviction_order(self, prompts):
+        """Returns the indices of the messages that can be evicted, in the order they should be evicted.
 
-        requests_delay = 60 / self.max_rpm
-        tokens_delay = (60 * num_tokens) / self.max_tpm
-        sleep_time = max(0.0, requests_delay - delta, tokens_delay - delta)
-        print(sleep_time)
-        time.sleep(sleep_time)
+        The system prompt, the initial request and the latest message are kept. Error messages and the answers to
+        them are evicted first, then the remaining messages from oldest to newest.
+        """
+        candidates = range(2, len(prompts) - 1)
+        errors = [i for i in candidates if prompts[i].content.startswith(ERROR_PREFIX)
+                  or (isinstance(prompts[i], AIMessage) and prompts[i - 1].content.startswith(ERROR_PREFIX))]
+        return errors + [i for i in candidates if i not in errors]
 
-        logger.debug(f"Request: {prompts}")
-        result = super()._generate(prompts, *args, **kwargs)
-        logger.debug(f"Response: {result}")
+    def _chop(self, message, max_tokens):
+        """Removes the shortest prefix of the message such that it has at most max_tokens tokens."""
+        content = message.content
+        lo, hi = 0, len(content)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get_message_len(message.copy(update={"content": content[mid:]})) <= max_tokens:
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo == len(content):
+            raise ValueError("Prompt too long. No more possibility to shorten it. Abort!")
+        return content[lo:]
 
+    def _log_call(self, prompts, result):
         if self.logging_dir is not None:
             time_dir = self.logging_dir / ".prompts" / self.start_time.strftime("%Y-%m-%d_%H-%M-%S")
             time_dir.mkdir(parents=True, exist_ok=True)
@@ -88,13 +219,22 @@ class MyOpenAI(ChatOpenAI):
             if self.call_counter > 50:
                 raise Exception("Too many prompts generated. Failed.")
 
+    def get_prompt_len(self, prompts):
+        return sum(self.get_message_len(p) for p in prompts) + PROMPT_OVERHEAD_TOKENS
 
-        self.last_call = current_call
+    def get_message_len(self, message):
+        """Returns the number of tokens of a message. Counts are cached by content, so each message is tokenized once."""
+        key = (type(message).__name__, message.content)
+        if self.message_tokens is None:
+            self.message_tokens = OrderedDict()
+        if key in self.message_tokens:
+            self.message_tokens.move_to_end(key)
+            return self.message_tokens[key]
+        result = self.message_tokens[key] = self.get_num_tokens(get_buffer_string([message])) + 1  # + 1 for line break
+        if len(self.message_tokens) > MESSAGE_TOKEN_CACHE_SIZE:
+            self.message_tokens.popitem(last=False)
         return result
 
-    def get_prompt_len(self, prompts):
-        return self.get_num_tokens(ChatPromptTemplate.from_messages(prompts).format()) + 100
-
 
 class MyClient(Completion):
     def __init__(self, client, llm):
@@ -102,15 +242,72 @@ class MyClient(Completion):
         self._llm = llm
 
     def create(self, *args, **kwargs):
+        # called for every attempt of langchain's retry loop, so retries are rate limited as well
+        with span("rate_limit_wait", "llm"):
+            self._llm.rate_limiter.acquire(self._start_attempt())
         try:
-            result = self._client.create(*args, **kwargs)
+            with span("llm_request", "llm"):
+                result = self._client.create(*args, **kwargs)
         except Exception as e:
-            if REDUCE_MULTIPLIER:
-                self._llm.max_rpm //= 2  # TODO also add possibility to increase rate again
-                self._llm.max_tpm //= 2
+            self._on_error(e)
             raise e
+        if kwargs.get("stream"):  # streamed requests only succeed once the whole response has arrived
+            return self._stream(result)
+        self._llm.rate_limiter.on_success()
         return result
 
+    async def acreate(self, *args, **kwargs):
+        with span("rate_limit_wait", "llm"):
+            await self._llm.rate_limiter.aacquire(self._start_attempt())
+        try:
+            with span("llm_request", "llm"):
+                result = await self._client.acreate(*args, **kwargs)
+        except Exception as e:
+            self._on_error(e)
+            raise e
+        if kwargs.get("stream"):
+            return self._astream(result)
+        self._llm.rate_limiter.on_success()
+        return result
+
+    def _stream(self, chunks):
+        try:
+            yield from chunks
+        except Exception as e:
+            self._on_interrupted(e)
+            raise e
+        self._llm.rate_limiter.on_success()
+
+    async def _astream(self, chunks):
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            self._on_interrupted(e)
+            raise e
+        self._llm.rate_limiter.on_success()
+
+    def _on_interrupted(self, e):
+        """Counts an error in the middle of a response stream and marks the request to be sent again."""
+        self._on_error(e)
+        request = _request.get()
+        if request is not None:
+            request["interrupted"] = True
+
+    def _start_attempt(self):
+        """Counts the request and returns its number of prompt tokens."""
+        request = _request.get() or {"tokens": 0, "attempts": 0}
+        request["attempts"] += 1
+        metrics.inc("llm_requests", model=self._llm.model_name)
+        if request["attempts"] > 1:
+            metrics.inc("llm_retries", model=self._llm.model_name)
+        return request["tokens"]
+
+    def _on_error(self, e):
+        metrics.inc("llm_request_errors", model=self._llm.model_name, error=type(e).__name__)
+        if isinstance(e, RateLimitError):
+            self._llm.rate_limiter.on_rate_limit()
+
     def __getattr__(self, _attr):
         return getattr(self._client, _attr)
 
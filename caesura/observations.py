@@ -1,6 +1,3 @@
-from langchain.prompts.chat import HumanMessagePromptTemplate
-
-
 class Observation(Exception):
     def __init__(self, *, description=None, step_nr=None, add_step_nr=None, target_phase=None,
                  plan_step_info=None):
@@ -25,6 +22,7 @@ class Observation(Exception):
             self.step_nr = i
 
     def get_message(self, suffix=None):
+        from langchain.prompts.chat import HumanMessagePromptTemplate  # observations are raised by langchain-free code
         msg = str(self)
         if suffix:
             msg += " " + suffix
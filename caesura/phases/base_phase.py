@@ -2,7 +2,10 @@ from abc import ABC, abstractmethod
 from copy import copy
 import logging
 
+from caesura.context import current_phase
+from caesura.metrics import metrics
 from caesura.observations import ExecutionError, Observation, PlanFinished
+from caesura.tracing import span
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +27,14 @@ class Phase(ABC):
             self.observation = observation
 
     def run(self, **state):
+        token = current_phase.set(type(self).__name__)
+        try:
+            with metrics.timer("phase_seconds"), span(type(self).__name__, category="phase"):
+                return self._run(**state)
+        finally:
+            current_phase.reset(token)
+
+    def _run(self, **state):
         state = copy(state)
         if self.chat_history is None:
             self.chat_history = self.init_chat(**state)
@@ -52,7 +63,8 @@ class Phase(ABC):
 
     def _execute(self, **kwargs):
         try:
-            execution_out = self.execute(**kwargs)
+            with span(f"{type(self).__name__}.execute", category="phase", step_nr=kwargs.get("step_nr")):
+                execution_out = self.execute(**kwargs)
         except PlanFinished as o:
             raise o
         except Observation as o:
@@ -123,7 +135,8 @@ class PhaseList():
         proceed_to_next_phase = False
         while (phase := self.get_next_phase(proceed_to_next_phase)) != None:
             try:
-                result = phase.run(**state)
+                with span("iteration", category="phase", phase=type(phase).__name__, step_nr=state["step_nr"]):
+                    result = phase.run(**state)
                 state.update(result)
                 proceed_to_next_phase = True
             except PlanFinished as o:
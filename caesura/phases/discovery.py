@@ -1,3 +1,4 @@
+import asyncio
 from functools import reduce
 import logging
 import re
@@ -7,6 +8,7 @@ from langchain.schema import AIMessage, HumanMessage, SystemMessage
 from langchain.prompts.chat import HumanMessagePromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate
 
 from caesura.phases.base_phase import ExecutionOutput, Phase
+from caesura.utils import TEXT_PLACEHOLDER, render_image_placeholders
 
 logger = logging.getLogger(__name__)
 relevant_col_tuple = namedtuple("relevant_column", ["table", "column", "contains", "reasons"])
@@ -118,12 +120,9 @@ class DiscoveryPhase(Phase):
         relevant_columns = RelevantColumns(self.database, query, self.llm) if "relevant_columns" not in kwargs \
             else kwargs["relevant_columns"]
 
-        for table_name, messages in chat_history.items():
-            if table_name == "__global__":
-                continue
-            prompt = ChatPromptTemplate.from_messages(messages)
-            llm_chain = LLMChain(llm=self.llm, prompt=prompt)
-            ai_output = llm_chain.predict()
+        table_names = [t for t in chat_history if t != "__global__"]
+        ai_outputs = self.predict_concurrently([ChatPromptTemplate.from_messages(chat_history[t]) for t in table_names])
+        for table_name, ai_output in zip(table_names, ai_outputs):
             chat_history[table_name].append(AIMessage(content=ai_output))
             cols = self.parse_relevant_columns(table_name, ai_output, self.get_relevance_questions(table_name))
             relevant_columns.extend(cols)
@@ -143,12 +142,28 @@ class DiscoveryPhase(Phase):
             relevant_columns.append(relevant_col_tuple(table, column, contains + ".", ""))
 
         logger.info(relevant_columns)
+        self.database.set_relevant_columns((c.table, c.column) for c in relevant_columns)
 
         return ExecutionOutput(
             state_update={"relevant_columns": relevant_columns},
             chat_history=chat_history,
         )
 
+    def predict_concurrently(self, prompts):
+        """Sends independent prompts at once and returns the outputs in the order of the prompts.
+
+        Falls back to sequential calls when called from within a running event loop.
+        """
+        chains = [LLMChain(llm=self.llm, prompt=p) for p in prompts]
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self._apredict(chains))
+        return [c.predict() for c in chains]
+
+    async def _apredict(self, chains):
+        return await asyncio.gather(*(c.apredict() for c in chains))
+
     def handle_observation(self, observation, chat_history, **kwargs):
         msg = observation.get_message("Retry answering the above questions!")
         result = {}
@@ -237,28 +252,9 @@ class RelevantColumns(list):
         return result
 
     def get_join_columns(self):
-        result = set()
-        for col in set(c.table for c in self):
-            result |= self.dfs(col, frozenset(c.table for c in self))
+        result = self.database.get_join_columns(set(c.table for c in self))
         return "\n - These are relevant primary / foreign keys: " + ", ".join(f"{t1}.{t2}"
-                                                                         for t1, t2 in sorted(result, key=lambda x: x[1]))
-    def dfs(self, table, relevant_tables, path=(), visited=frozenset()):
-        result = set()
-        for link in self.database.tables[table].links:
-            neighbor, neighbor_col = next(iter(
-                (t.name, c) for t, c  in ((link.table1, link.column1), (link.table2, link.column2)) if t.name != table))
-            if neighbor in visited:
-                continue
-            table, table_col = next(iter(
-                (t.name, c) for t, c  in ((link.table1, link.column1), (link.table2, link.column2)) if t.name == table))
-    
-            step = ((table, table_col), (neighbor, neighbor_col))
-            this_path = path + step
-            if neighbor in relevant_tables:
-                result |= set(this_path)
-            else:
-                result |= self.dfs(neighbor, relevant_tables, this_path, visited=frozenset(visited | {table}))
-        return result
+                                                                         for t1, t2 in sorted(result, key=lambda x: (x[1], x[0])))
 
     def with_tool_hints(self):
         return self.__str__(with_tool_hints=True)
@@ -272,20 +268,20 @@ class RelevantColumns(list):
 
     def append(self, c):
         if c in self or c.table not in self.database.tables or \
-                c.column not in self.database.tables[c.table].data_frame.columns:
+                c.column not in self.database.tables[c.table].get_columns():
             return
 
         super().append(c)
-        if c.table not in self.database.tables or c.column not in self.database.tables[c.table].data_frame.columns:
+        if c.table not in self.database.tables or c.column not in self.database.tables[c.table].get_columns():
             return
-        self.example_values[c] = self.database.tables[c.table].data_frame[c.column][:30].unique()[:10].tolist()
+        self.example_values[c] = self.database.tables[c.table].head(30, [c.column])[c.column].unique()[:10].tolist()
         if self.database.get_column_datatype(c.table, c.column) == "IMAGE":
-            self.example_values[c] = self.example_values[c][:3]
+            self.example_values[c] = render_image_placeholders(self.example_values[c][:3]).tolist()
             self.default_hints[c] = f" You should look at images in {c.table}.{c.column} to figure out what they depict."
             self.tool_hints[c] = f" Use Visual Question Answering to look at the images in {c.table}.{c.column} and extract information. Use Image Select to filter rows by what is depicted on the images."
         if self.database.get_column_datatype(c.table, c.column) == "TEXT":
             self.example_values[c] = self.example_values[c][:3]
-            self.example_values[c] = ["<TEXT>" for _ in self.example_values[c]]
+            self.example_values[c] = [TEXT_PLACEHOLDER for _ in self.example_values[c]]
             self.default_hints[c] = f" You should read the texts in {c.table}.{c.column} to figure out what they contain."
             self.tool_hints[c] = f" Use Text Question Answering to read the texts in {c.table}.{c.column} and extract information from them."
         if self.database.has_relevant_values_index(c.table, c.column):
@@ -318,7 +314,7 @@ class RelevantColumns(list):
                 continue
             column, keywords = tuple(x.strip() for x in line.split(":"))
             table, column = column.split(".")
-            if table not in self.database.tables or column not in self.database.tables[table].data_frame.columns:
+            if table not in self.database.tables or column not in self.database.tables[table].get_columns():
                 continue
             keywords = [x.strip() for x in keywords.split(",")]
             values = self.database.get_relevant_values(table, column, keywords)
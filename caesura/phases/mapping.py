@@ -1,9 +1,12 @@
 import re
 import logging
+import time
 from langchain import LLMChain
+from langchain.callbacks.base import BaseCallbackHandler
 from langchain.schema import AIMessage
 from langchain.prompts.chat import HumanMessagePromptTemplate, ChatPromptTemplate, SystemMessagePromptTemplate
 
+from caesura.metrics import metrics
 from caesura.phases.base_phase import ExecutionOutput, Phase
 from caesura.phases.planning import PlanningPhase
 from caesura.observations import ExecutionError, Observation, PlanFinished
@@ -13,8 +16,16 @@ from caesura.utils import parse_args
 
 logger = logging.getLogger(__name__)
 
+# a Tool line followed by a complete Arguments line: a single line, or a parenthesized one that is closed
+FIRST_TOOL_CALL = re.compile(r"Tool(| [0-9]+):.*\n\s*Arguments(| [0-9]+):[ \t]*(\([^\n]*\)|[^\n(][^\n]*)[ \t]*\n")
+
+
 class MappingPhase(Phase):
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.time_to_first_tool = []
+
     def create_prompt(self, tools):
         result = ChatPromptTemplate.from_messages([
             self.system_prompt(tools),
@@ -45,7 +56,11 @@ class MappingPhase(Phase):
         llm_chain = LLMChain(llm=self.llm, prompt=prompt)
         step = plan[step_nr - 1]
 
-        ai_output = llm_chain.predict(stop=[f"Step {step_nr + 1}"])
+        for tool in tools:
+            tool.discard_speculations()
+        start = time.perf_counter()
+        stream_parser = ToolCallStreamParser(lambda text: self.speculate_first_tool(text, tools, step, start))
+        ai_output = llm_chain.predict(stop=[f"Step {step_nr + 1}"], callbacks=[stream_parser])
         chat_history += [AIMessage(content=ai_output)]
         logger.info(ai_output)
 
@@ -103,7 +118,8 @@ class MappingPhase(Phase):
         )
         prompt = ChatPromptTemplate.from_messages(chat_history + [msg])
         chain = LLMChain(llm=self.llm, prompt=prompt)
-        answers = chain.predict(error_step=error_step, error_tool=error_tool, query=query, plan=plan.without_tools())
+        with metrics.timer("error_analysis_seconds"):
+            answers = chain.predict(error_step=error_step, error_tool=error_tool, query=query, plan=plan.without_tools())
         logger.warning(error)
         logger.warning(answers)
         fix_idea, wrong_plan_str1, wrong_plan_str2, wrong_tool, wrong_input_args = \
@@ -130,6 +146,19 @@ class MappingPhase(Phase):
         chat_history.append(error.get_message(suffix="\nPlease restart from Step 1"))
         return chat_history
 
+    def speculate_first_tool(self, ai_out, tools, step, start):
+        """Starts the first tool call of a partial output in the background, while the LLM is still generating."""
+        try:
+            tool_calls = self.parse_tool_calls(ai_out, tools, step)
+        except Exception as e:  # the complete output is parsed again and errors are reported then
+            logger.debug(f"Could not parse partial output: {e}")
+            return
+        self.time_to_first_tool.append(time.perf_counter() - start)
+        metrics.observe("time_to_first_tool_seconds", self.time_to_first_tool[-1])
+        logger.info(f"Time to first tool: {self.time_to_first_tool[-1]:.2f}s")
+        if tool_calls:
+            tool_calls[0].tool.speculate(step.input_tables, tool_calls[0].args)
+
     def parse_tool_calls(self, ai_out, tools, step):
         tools_str = [re.split(r"[,\.\n\(\:]", x.strip())[0].strip() for x in re.split("Tool(| [0-9]+):", ai_out)[2::2]]
         tool_map = {t.name: t for t in tools}
@@ -161,6 +190,24 @@ class MappingPhase(Phase):
         return found_separator
 
 
+class ToolCallStreamParser(BaseCallbackHandler):
+    """Watches the streamed LLM output and reports the output up to the first complete Tool/Arguments pair."""
+
+    def __init__(self, on_tool_call):
+        self.on_tool_call = on_tool_call
+        self.text = ""
+        self.found = False
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.found:
+            return
+        self.text += token
+        match = FIRST_TOOL_CALL.search(self.text)
+        if match:
+            self.found = True
+            self.on_tool_call(self.text[:match.end()])
+
+
 STEP_PROMPT = "Step {step_nr}: {step_prompt}"
 INIT_PROMPT = "Execute the steps one by one. {relevant_columns}. Take these into account when executing the tools.\n" + \
     STEP_PROMPT
@@ -5,6 +5,7 @@ from caesura.capabilities import ALL_CAPABILITIES
 from langchain.schema import AIMessage
 from langchain.prompts.chat import HumanMessagePromptTemplate, ChatPromptTemplate, AIMessagePromptTemplate, SystemMessagePromptTemplate
 
+from caesura.metrics import metrics
 from caesura.phases.base_phase import ExecutionOutput, Phase
 from caesura.phases.discovery import DiscoveryPhase
 from caesura.observations import ExecutionError
@@ -133,7 +134,8 @@ class PlanningPhase(Phase):
         )
         prompt = ChatPromptTemplate.from_messages(chat_history + [msg])
         chain = LLMChain(llm=self.llm, prompt=prompt)
-        answers = chain.predict()
+        with metrics.timer("error_analysis_seconds"):
+            answers = chain.predict()
         logger.warning(observation)
         logger.warning(answers)
         _, fix_idea, additional_cols_str = \
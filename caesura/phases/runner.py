@@ -6,6 +6,8 @@ class RunnerPhase(Phase):
     is_step_by_step = True
 
     def execute(self, step_nr, step, **kwargs):
+        if "plan" in kwargs:  # tables not needed by the remaining steps can be spilled to disk first
+            self.database.set_referenced_tables(t for s in kwargs["plan"][step_nr - 1:] for t in s.input_tables)
         observation = None
         for i, call in enumerate(step.tool_execs):
             observation = self.tool_execute(step_nr, step, call.tool, call.args,
@@ -14,7 +16,7 @@ class RunnerPhase(Phase):
 
     def tool_execute(self, step_nr, step, tool, args, is_first, is_last):
         try:
-            observation = tool.run(tables=step.input_tables if is_first else ["tmp"], input_args=args,
+            observation = tool.execute(tables=step.input_tables if is_first else ["tmp"], input_args=args,
                                    output=step.output_table if is_last else "tmp")
         except ExecutionError as e:
             e.set_target_phase(type(self.previous))
@@ -0,0 +1,126 @@
+import asyncio
+from contextlib import contextmanager
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+from caesura.metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # no file locks on this platform, the limiter is only shared between threads
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PATH = Path(".rate_limits/")
+BURST_SECONDS = 10
+INCREASE = 0.01
+DECREASE = 0.5
+MIN_FRACTION = 0.05
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name, max_rpm, max_tpm, path=RATE_LIMIT_PATH):
+    """Returns the rate limiter of a model. Limiters with the same state file share one quota across processes."""
+    with _limiters_lock:
+        key = (name, Path(path).resolve())
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(name, max_rpm, max_tpm, path)
+        return _limiters[key]
+
+
+class RateLimiter():
+    """Token buckets for requests and tokens per minute.
+
+    The bucket state lives in a small JSON file guarded by a file lock, so all threads and processes using the same
+    file share the quota. Rates adapt AIMD-style: they are cut by DECREASE on every rate limit error and grow back
+    by INCREASE of the quota on every successful request.
+    """
+
+    def __init__(self, name, max_rpm, max_tpm, path=RATE_LIMIT_PATH):
+        self.max_rpm = max_rpm
+        self.max_tpm = max_tpm
+        self.path = Path(path) / f"{name}.json"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _state(self):
+        """Locks, loads and refills the bucket state, and writes it back afterwards."""
+        with self._lock, open(os.open(self.path, os.O_RDWR | os.O_CREAT), "r+") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:
+                state = {}
+            now = time.time()
+            rpm, tpm = state.get("rpm", self.max_rpm), state.get("tpm", self.max_tpm)
+            elapsed = max(now - state.get("updated", now), 0)
+            state = {
+                "rpm": rpm,
+                "tpm": tpm,
+                "requests": min(self._capacity(rpm), state.get("requests", self._capacity(rpm)) + elapsed * rpm / 60),
+                "tokens": min(self._capacity(tpm), state.get("tokens", self._capacity(tpm)) + elapsed * tpm / 60),
+                "updated": now,
+            }
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+    def _capacity(self, rate):
+        return max(rate * BURST_SECONDS / 60, 1)
+
+    def try_acquire(self, num_tokens):
+        """Takes a request and the tokens from the buckets. Returns 0 on success, otherwise the seconds to wait.
+
+        Requests larger than the burst capacity are sent once the token bucket is full and charged in full. The bucket
+        then goes into debt, which later requests wait for.
+        """
+        with self._state() as state:
+            required = min(num_tokens, self._capacity(state["tpm"]))
+            if state["requests"] >= 1 and state["tokens"] >= required:
+                state["requests"] -= 1
+                state["tokens"] -= num_tokens
+                return 0
+            return max((1 - state["requests"]) * 60 / state["rpm"], (required - state["tokens"]) * 60 / state["tpm"])
+
+    def acquire(self, num_tokens):
+        """Blocks until the request can be sent."""
+        wait = self.try_acquire(num_tokens)
+        while wait > 0:
+            logger.debug(f"Rate limit reached, waiting {wait:.2f}s.")
+            metrics.inc("rate_limit_sleep_seconds", wait)
+            time.sleep(wait)
+            wait = self.try_acquire(num_tokens)
+
+    async def aacquire(self, num_tokens):
+        """Waits without blocking the event loop until the request can be sent."""
+        wait = self.try_acquire(num_tokens)
+        while wait > 0:
+            logger.debug(f"Rate limit reached, waiting {wait:.2f}s.")
+            metrics.inc("rate_limit_sleep_seconds", wait)
+            await asyncio.sleep(wait)
+            wait = self.try_acquire(num_tokens)
+
+    def on_success(self):
+        """Additively increases the rates towards the quota."""
+        with self._state() as state:
+            state["rpm"] = min(self.max_rpm, state["rpm"] + INCREASE * self.max_rpm)
+            state["tpm"] = min(self.max_tpm, state["tpm"] + INCREASE * self.max_tpm)
+
+    def on_rate_limit(self):
+        """Multiplicatively decreases the rates and empties the buckets."""
+        with self._state() as state:
+            state["rpm"] = max(MIN_FRACTION * self.max_rpm, state["rpm"] * DECREASE)
+            state["tpm"] = max(MIN_FRACTION * self.max_tpm, state["tpm"] * DECREASE)
+            state["requests"], state["tokens"] = 0, min(state["tokens"], 0)  # debt is kept
+            logger.info(f"Rate limit error, reducing rates to {state['rpm']:.0f} RPM and {state['tpm']:.0f} TPM.")
@@ -0,0 +1,105 @@
+from collections import Counter, defaultdict
+import logging
+from pathlib import Path
+from typing import Any
+
+from langchain.schema import AIMessage, ChatGeneration, ChatResult
+from rapidfuzz import fuzz, process
+
+from caesura.llm_cache import normalize
+from caesura.metrics import metrics
+from caesura.model import MyOpenAI
+
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_SEPARATOR = "*" * 300
+MESSAGE_SEPARATOR = "\n\n--\n"
+FUZZY_THRESHOLD = 90
+
+
+def load_trace(path):
+    """Loads the prompts and responses that MyOpenAI logged to .prompts/<timestamp>/<n> files below a directory."""
+    files = [f for f in Path(path).rglob("*") if f.is_file() and f.name.isdigit()]
+    files.sort(key=lambda f: (str(f.parent), int(f.name)))
+    trace = []
+    for f in files:
+        prompt, sep, response = f.read_text().partition("\n" + RESPONSE_SEPARATOR + "\n")
+        if not sep:
+            logger.warning(f"Skipping {f}: no response found.")
+            continue
+        trace.append((prompt, response[:-1] if response.endswith("\n") else response))
+    return trace
+
+
+def format_prompt(prompts):
+    """Formats the messages like they are logged by MyOpenAI."""
+    return MESSAGE_SEPARATOR.join(f"{type(p).__name__}: {p.content}" for p in prompts)
+
+
+class ReplayLLM(MyOpenAI):
+    """Answers prompts from a trace recorded by MyOpenAI instead of calling the API.
+
+    Prompts are matched exactly (up to whitespace) first, repeated prompts get their recorded responses in order.
+    Otherwise, the most similar recorded prompt is used if its similarity is at least fuzzy_threshold. Prompts
+    without a match are collected in misses and raise a ValueError.
+    """
+    trace_path: Path = None
+    fuzzy_threshold: int = FUZZY_THRESHOLD
+    responses: Any = None
+    misses: Any = None
+    replay_counters: Any = None
+
+    def __init__(self, trace_path, **kwargs):
+        kwargs.setdefault("openai_api_key", "replay")
+        super().__init__(trace_path=Path(trace_path), **kwargs)
+        if self.responses is None:
+            self.responses = defaultdict(list)
+            for prompt, response in load_trace(self.trace_path):
+                self.responses[normalize(prompt)].append(response)
+            logger.info(f"Loaded {sum(len(r) for r in self.responses.values())} recorded responses from {self.trace_path}.")
+        self.misses = [] if self.misses is None else self.misses
+        self.replay_counters = Counter() if self.replay_counters is None else self.replay_counters
+
+    def continued(self, **kwargs):
+        """Returns a new replay LLM that continues with the same trace position, misses and counters."""
+        kwargs = {"model_name": self.model_name, "max_tokens": self.max_tokens, "temperature": self.temperature,
+                  "logging_dir": self.logging_dir, **kwargs}
+        return ReplayLLM(self.trace_path, responses=self.responses, misses=self.misses,
+                         replay_counters=self.replay_counters, **kwargs)
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        prompts, _ = self._shorten(prompts)  # recorded prompts have been shortened the same way
+        text = self._replay(prompts)
+        if run_manager:
+            run_manager.on_llm_new_token(text)
+        result = ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+        self._log_call(prompts, result)
+        return result
+
+    async def _agenerate(self, prompts, stop=None, run_manager=None, **kwargs):
+        prompts, _ = self._shorten(prompts)  # recorded prompts have been shortened the same way
+        text = self._replay(prompts)
+        if run_manager:
+            await run_manager.on_llm_new_token(text)
+        result = ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+        self._log_call(prompts, result)
+        return result
+
+    def _replay(self, prompts):
+        metrics.inc("llm_calls", model=self.model_name, source="replay")
+        prompt = format_prompt(prompts)
+        key = normalize(prompt)
+        if key not in self.responses:
+            match = process.extractOne(key, list(self.responses), scorer=fuzz.ratio, score_cutoff=self.fuzzy_threshold)
+            if match is None:
+                self.replay_counters["misses"] += 1
+                self.misses.append(prompt)
+                logger.warning(f"No recorded response for prompt:\n{prompt}")
+                raise ValueError("No recorded response for prompt.")
+            self.replay_counters["fuzzy"] += 1
+            key = match[0]
+        else:
+            self.replay_counters["exact"] += 1
+        responses = self.responses[key]
+        return responses.pop(0) if len(responses) > 1 else responses[0]  # the last response is reused
@@ -2,16 +2,16 @@ from caesura.database.database import Database
 import datetime
 
 
-def get_database(scenario, sampled=True):
+def get_database(scenario, sampled=True, lazy=False):
     if scenario == "artwork":
-        return artwork_scenario(sampled=sampled)
+        return artwork_scenario(sampled=sampled, lazy=lazy)
     if scenario == "rotowire":
-        return rotowire_scenario(sampled=sampled)
+        return rotowire_scenario(sampled=sampled, lazy=lazy)
     raise KeyError(scenario)
 
 
-def artwork_scenario(sampled=True):
-    dl = Database()
+def artwork_scenario(sampled=True, lazy=False):
+    dl = Database(lazy=lazy)
     dl.add_tabular_table("paintings_metadata", f"datasets/art/paintings{'_sampled' if sampled else ''}.csv",
                            "a table that contains general information about paintings", path_columns=("img_path",))
     mask = dl._tables["paintings_metadata"].data_frame["inception"].apply(lambda x: not x.startswith("http"))
@@ -24,8 +24,8 @@ def artwork_scenario(sampled=True):
     return dl
 
 
-def rotowire_scenario(sampled=True):
-    dl = Database()
+def rotowire_scenario(sampled=True, lazy=False):
+    dl = Database(lazy=lazy)
     dl.add_tabular_table("players", "datasets/rotowire/players.csv",
                          "a table that contains general information about basketball players")
     dl.add_tabular_table("teams", "datasets/rotowire/teams.csv",
@@ -40,9 +40,9 @@ def rotowire_scenario(sampled=True):
     dl.link("teams_to_games", "game_reports", "game_id")
     dl.link("teams", "teams_to_games", "name")
     dl.link("players", "players_to_games", "name")
-    dl.build_relevant_values_index("players", "name", "nationality", "position")
-    dl.build_relevant_values_index("teams", "arena", "location", "president", "coach")
-    dl.tables["players"].data_frame["birth_date"].apply(
+    dl.build_relevant_values_indexes({"players": ["name", "nationality", "position"],
+                                      "teams": ["arena", "location", "president", "coach"]})
+    dl.tables["players"].get_values("birth_date").apply(
         lambda x: datetime.datetime.strptime(x, "%d.%m.%Y").strftime("%Y-%m-%d")
     )
     return dl
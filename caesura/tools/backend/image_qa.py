@@ -3,6 +3,8 @@ import requests
 from PIL import Image
 from transformers import BlipProcessor, BlipForQuestionAnswering
 
+from caesura.tracing import span
+
 
 class VisualQA():
     def __init__(self):
@@ -14,9 +16,11 @@ class VisualQA():
         results = []
         for i in range(0, len(image_paths), batch_size):
             with ExitStack() as stack:
-                images = [stack.enter_context(Image.open(image_path)) for image_path in image_paths[i: i + batch_size]]
-                inputs = self.processor(images=images, text=query, return_tensors="pt", padding=True)
-                outputs = self.model.generate(**inputs, max_length=20)
+                with span("decode_images", "model", num_images=len(image_paths[i: i + batch_size])):
+                    images = [stack.enter_context(Image.open(image_path)) for image_path in image_paths[i: i + batch_size]]
+                    inputs = self.processor(images=images, text=query, return_tensors="pt", padding=True)
+                with span("model_forward", "model", model="blip-vqa-base"):
+                    outputs = self.model.generate(**inputs, max_length=20)
 
                 results.extend([self.processor.decode(o, skip_special_tokens=True) for o in outputs])
         return results
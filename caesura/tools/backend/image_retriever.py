@@ -10,6 +10,7 @@ import uuid
 from pathlib import Path
 from caesura.database.table import Table
 
+from caesura.tracing import span
 from caesura.utils import get_paths_from_images
 import numpy as np
 import logging
@@ -40,7 +41,7 @@ class ImageRetriever():
                 chroma_db_impl="duckdb+parquet",
                 persist_directory=str(CHROMADB_PATH),
             ))
-        collection_name = f"ir-{table.name}-{column}-{len(table.data_frame[column])}"
+        collection_name = f"ir-{table.name}-{column}-{table.get_fingerprint(column)[:16]}"
         try:
             self.index[column] = self.client.create_collection(collection_name)
         except ValueError:  # collection already exists
@@ -56,20 +57,24 @@ class ImageRetriever():
         Returns:
             list: list of image paths that are similar to the query.   # TODO separate index per table
         """
-        text_embedding = self.get_text_embeddings(query)[0].tolist()
-        result = self.index[column].query(
-            query_embeddings=text_embedding,
-            n_results=min(100, self.index[column].count()),
-        )
+        with span("text_embedding", "model"):
+            text_embedding = self.get_text_embeddings(query)[0].tolist()
+        with span("index_query", "model"):
+            result = self.index[column].query(
+                query_embeddings=text_embedding,
+                n_results=min(100, self.index[column].count()),
+            )
         downsized_paths = result["documents"][0]
         image_paths = result["ids"][0]
 
         result = []
         for i in range(0, len(image_paths), batch_size):
             with ExitStack() as stack:
-                images = [stack.enter_context(Image.open(p)) for p in downsized_paths[i: i + batch_size]]
-                inputs = self.processor(images=images, text=query, return_tensors="pt")
-                outputs = self.model(**inputs, use_itm_head=True)
+                with span("decode_images", "model", num_images=len(downsized_paths[i: i + batch_size])):
+                    images = [stack.enter_context(Image.open(p)) for p in downsized_paths[i: i + batch_size]]
+                    inputs = self.processor(images=images, text=query, return_tensors="pt")
+                with span("model_forward", "model", model="blip-itm-base-coco"):
+                    outputs = self.model(**inputs, use_itm_head=True)
 
                 distance = outputs.itm_score[:, 0].view(-1)
                 # sort images by distance
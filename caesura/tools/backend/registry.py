@@ -0,0 +1,84 @@
+from importlib import import_module
+import logging
+import threading
+import time
+
+from caesura.metrics import metrics
+from caesura.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+# backends by name, as module:class so that their heavy dependencies are only imported when they are loaded
+BACKENDS = {
+    "image_retriever": "caesura.tools.backend.image_retriever:ImageRetriever",
+    "visual_qa": "caesura.tools.backend.image_qa:VisualQA",
+    "text_qa": "caesura.tools.backend.text_qa:TextQA",
+}
+
+
+class ModelRegistry():
+    """Process-wide registry of model backends.
+
+    Every backend is loaded once and shared by all tools and Caesura sessions in the process, so restarts and new
+    sessions do not reload the weights. Tools hold ModelHandles instead of the backends themselves.
+    """
+
+    def __init__(self, backends=BACKENDS):
+        self.backends = dict(backends)
+        self.load_times = {}
+        self._models = {}
+        self._locks = {name: threading.Lock() for name in self.backends}
+
+    def handle(self, name):
+        """Returns a handle to a backend. The backend is loaded when the handle is first used."""
+        if name not in self.backends:
+            raise ValueError(f"Unknown model backend {name}. Available: {', '.join(self.backends)}")
+        return ModelHandle(self, name)
+
+    def get(self, name):
+        """Returns a backend, loading it if necessary. Concurrent calls for the same backend load it only once."""
+        if name in self._models:
+            return self._models[name]
+        with self._locks[name]:
+            if name not in self._models:
+                self._models[name] = self._load(name)
+        return self._models[name]
+
+    def _load(self, name):
+        module, cls = self.backends[name].split(":")
+        logger.info(f"Loading model backend {name}.")
+        start = time.perf_counter()
+        with span(f"load {name}", "model"):
+            model = getattr(import_module(module), cls)()
+        self.load_times[name] = time.perf_counter() - start
+        metrics.observe("model_load_seconds", self.load_times[name], model=name)
+        logger.info(f"Loaded model backend {name} in {self.load_times[name]:.2f}s.")
+        return model
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def unload(self, name):
+        """Drops a backend, e.g. to free memory. It is loaded again on its next use."""
+        with self._locks[name]:
+            self._models.pop(name, None)
+
+
+class ModelHandle():
+    """Reference to a backend in a ModelRegistry."""
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def get(self):
+        return self.registry.get(self.name)
+
+    @property
+    def is_loaded(self):
+        return self.registry.is_loaded(self.name)
+
+
+# backends of the process
+models = ModelRegistry()
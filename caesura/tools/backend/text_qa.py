@@ -1,6 +1,8 @@
 import torch
 from typing import List
 from transformers import AutoTokenizer, BartForQuestionAnswering
+
+from caesura.tracing import span
 BATCH_SIZE = 2
 
 
@@ -13,13 +15,15 @@ class TextQA():
 
     def extract(self, texts: List[str], query: List[str]):
         """Retrieves images from the database."""
-        data = self.tokenizer(query.tolist(), texts.tolist(), return_tensors="pt", padding=True, truncation=True)
+        with span("tokenize", "model", num_texts=len(texts)):
+            data = self.tokenizer(query.tolist(), texts.tolist(), return_tensors="pt", padding=True, truncation=True)
         _, uq_indexes, uq_inverse = unique(data["input_ids"], dim=0)
         data_unique = {k: v[uq_indexes] for k, v in data.items()}
         result_values = list()
         for i in range(0, data_unique["input_ids"].shape[0], BATCH_SIZE):
             inputs = {k: v[i: i + BATCH_SIZE] for k, v in data.items()}
-            result = self.model(**inputs)
+            with span("model_forward", "model", model="bart-large-finetuned-squadv1"):
+                result = self.model(**inputs)
             start = result["start_logits"].argmax(1)
             end = result["start_logits"].argmax(1)
             for i in range(len(start)):
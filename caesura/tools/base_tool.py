@@ -1,8 +1,23 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import logging
 
+from caesura.metrics import metrics
 from caesura.observations import ExecutionError
+from caesura.tracing import span
+
+
+logger = logging.getLogger(__name__)
+
+# runs speculative extractions while the LLM is still generating
+_speculation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculation")
+
 
 class BaseTool(ABC):
+    # datatype of the columns the tool works on. Its models are only warmed up if the database has such columns.
+    datatype = None
+
     def __init__(self, database):
         super().__init__()
         self.database = database
@@ -14,8 +29,87 @@ class BaseTool(ABC):
     def run(self, tables, input_args, output) -> str:
         pass
 
+    def execute(self, tables, input_args, output):
+        """Runs the tool and records its run time."""
+        with metrics.timer("tool_seconds", tool=self.name), span(self.name, "tool"):
+            return self.run(tables=tables, input_args=input_args, output=output)
+
+    def warm_up(self):
+        """Loads the models of the tool ahead of its first use."""
+        pass
+
     def validate_args(self, args):
         if len(args) != len(self.args):
             raise ExecutionError(
                 description=f"Expected {len(self.args)} argument(s) for {self.name} tool. "
                 f"Please specify these arguments: ({'; '.join(self.args)})")
+
+    def speculate(self, tables, input_args):
+        """Starts the expensive part of a call of run in the background. Returns whether a speculation was started."""
+        return False
+
+    def discard_speculations(self):
+        """Drops speculations that were not used."""
+        pass
+
+
+class SpeculativeTool(BaseTool):
+    """Tool that splits off the expensive part of run into extract, so it can start while the LLM is still generating.
+
+    extract runs in a background thread. It must only read the database through read-only methods such as
+    Database.read_column_values.
+    """
+
+    def __init__(self, database):
+        super().__init__(database)
+        self._speculations = {}
+
+    @abstractmethod
+    def get_speculation_key(self, tables, input_args):
+        """Returns the arguments of extract for a call of run, or None if the call should not be speculated."""
+        pass
+
+    @abstractmethod
+    def extract(self, *key):
+        """Computes the expensive part of run. Must not modify the database."""
+        pass
+
+    def speculate(self, tables, input_args):
+        try:
+            key = self.get_speculation_key(tables, input_args)
+        except Exception as e:  # invalid calls are not speculated, run reports the error
+            logger.debug(f"Not speculating {self.name}: {e}")
+            return False
+        if key is None:
+            return False
+        if key not in self._speculations:
+            context = contextvars.copy_context()  # attribute the work to the current phase
+            self._speculations[key] = _speculation_executor.submit(context.run, self._timed_extract, *key)
+            metrics.inc("tool_speculations", tool=self.name, outcome="started")
+        return True
+
+    def extracted(self, *key):
+        """Returns the result of extract, from a matching speculation if there is one."""
+        future = self._speculations.pop(key, None)
+        if future is not None and future.cancel():  # still queued behind discarded work, do not wait for it
+            metrics.inc("tool_speculations", tool=self.name, outcome="cancelled")
+        elif future is not None:
+            try:
+                result = future.result()
+                metrics.inc("tool_speculations", tool=self.name, outcome="used")
+                return result
+            except Exception as e:  # extract again, to raise the error in the calling thread
+                logger.debug(f"Speculation of {self.name} failed: {e}")
+        return self._timed_extract(*key)
+
+    def _timed_extract(self, *key):
+        with metrics.timer("tool_extract_seconds", tool=self.name), span(f"{self.name}.extract", "tool"):
+            return self.extract(*key)
+
+    def discard_speculations(self):
+        """Drops speculations that were not used. Queued ones are cancelled, running ones finish in the background."""
+        if self._speculations:
+            metrics.inc("tool_speculations", len(self._speculations), tool=self.name, outcome="discarded")
+        for future in self._speculations.values():
+            future.cancel()
+        self._speculations = {}
@@ -1,10 +1,12 @@
-from caesura.database.database import Database, Table
-from caesura.tools.backend.image_retriever import ImageRetriever
-from caesura.tools.base_tool import BaseTool
+import threading
+import numpy as np
+from caesura.database.database import Database
+from caesura.tools.backend.registry import models
+from caesura.tools.base_tool import SpeculativeTool
 
 from caesura.utils import get_paths_from_images
 
-class ImageSelectTool(BaseTool):
+class ImageSelectTool(SpeculativeTool):
     name = "Image Select"
     description = (
         "It is useful for when you want to select tuples based on what is depicted in images (column with IMAGE datatype) e.g. to select all rows where the image depicts a skateboard. "
@@ -12,10 +14,13 @@ class ImageSelectTool(BaseTool):
         "The tool selects the tuples where the images match the description. It will not add new columns to the table.\n"
     )
     args = ("column with IMAGE datatype", "the description to match")
+    datatype = "IMAGE"
 
     def __init__(self, database: Database):
         super().__init__(database)
-        self.retriever = ImageRetriever()
+        self.retriever = models.handle("image_retriever")
+        self._pending = []  # ingested tables that are not indexed yet
+        self._pending_lock = threading.Lock()
 
     def run(self, tables, input_args, output):
         """Use the tool."""
@@ -23,26 +28,54 @@ class ImageSelectTool(BaseTool):
         column, query = tuple(input_args)
         if "." in column:
             table, column = column.split(".")
-        images = self.database.get_column_values(table, column, force_datatype="IMAGE")
-        paths = get_paths_from_images(images)
-        result = self.retriever.retrieve(paths, query, table, column)
-        image_placeholders = [f"<IMAGE stored at '{x}'>" for x in result]
+        result = self.extracted(table, column, query)
         ds = self.database.tables[table]
-        mask = ds.data_frame[column].isin(image_placeholders)
-        result = ds.data_frame[mask]
-
-        result = Table(output if output is not None else table, result,
-                         f"Result of retrieval: table={table}, column={column}, query={query}",
-                         parent=ds)
+        images = ds.data_frame[column].astype("category")
+        selected = images.cat.categories.get_indexer(result)
+        mask = np.isin(images.cat.codes.values, selected[selected >= 0])
+        result = ds.derive(output if output is not None else table,
+                           f"Result of retrieval: table={table}, column={column}, query={query}",
+                           rows=mask)
 
         # Add the result to the working memory
         return self.database.register_working_memory(result)
 
+    def get_speculation_key(self, tables, input_args):
+        table = tables[0]
+        column, query = tuple(input_args)
+        if "." in column:
+            table, column = column.split(".")
+        return table, column, query
+
+    def warm_up(self):
+        self.retriever.get()
+        self._index_pending()
+
+    def extract(self, table, column, query):
+        self._index_pending()
+        images = self.database.read_column_values(table, column, force_datatype="IMAGE")
+        paths = get_paths_from_images(images)
+        return self.retriever.get().retrieve(paths, query, table, column)
+
     def on_ingest(self, table, start_index, end_index):
-        """Called when a new data is ingested."""
-        self.retriever.on_ingest(table, start_index, end_index)
+        """Called when a new data is ingested. Images are indexed on warm-up or before the next retrieval."""
+        if any(table.get_datatype_for_column(c) == "IMAGE" for c in table.get_columns()):
+            with self._pending_lock:
+                self._pending.append((table, start_index, end_index))
 
     def persist(self):
         """Persist the tool."""
-        self.retriever.persist()
+        if self.retriever.is_loaded:
+            self.retriever.get().persist()
+
+    def _index_pending(self):
+        """Indexes the images of ingested tables. Holds the lock while indexing, so retrievals wait for it."""
+        with self._pending_lock:
+            if not self._pending:
+                return
+            retriever = self.retriever.get()
+            for table, start_index, end_index in self._pending:
+                retriever.on_ingest(table, start_index, end_index)
+            self._pending = []
+            retriever.persist()
 
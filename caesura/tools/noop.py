@@ -1,6 +1,5 @@
 from caesura.database.database import Database
 from caesura.tools.base_tool import BaseTool
-from copy import deepcopy
 
 
 class NoopTool(BaseTool):
@@ -19,8 +18,7 @@ class NoopTool(BaseTool):
         table = tables[0]
         result = self.database.get_table_by_name(table)
         if output is not None:
-            result = deepcopy(result)
-            result.name = output
+            result = result.derive(output, result.description)
         return self.database.register_working_memory(result)
 
     def validate_args(self, args):
@@ -1,7 +1,5 @@
 from pathlib import Path
 from typing import Optional
-import seaborn as sns
-from matplotlib import pyplot as plt
 from caesura.database.database import Database
 from caesura.tools.base_tool import BaseTool
 from caesura.observations import ExecutionError
@@ -28,6 +26,8 @@ class PlottingTool(BaseTool):
         """Use the tool."""
         table = tables[0]
         plot_type, col_x, col_y = tuple(input_args)
+        import seaborn as sns  # slow to import, only needed for plots
+        from matplotlib import pyplot as plt
         try:
             if plot_type == "line":
                 sns.lineplot(data=self.database.get_table_by_name(table).data_frame,
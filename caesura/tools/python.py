@@ -2,7 +2,7 @@ import re
 import importlib
 import logging
 from langchain import LLMChain, PromptTemplate
-from caesura.database.database import Database, Table
+from caesura.database.database import Database
 from caesura.observations import Observation
 from caesura.tools.base_tool import BaseTool
 from caesura.observations import ExecutionError
@@ -44,11 +44,11 @@ class TransformTool(BaseTool):
         if column in ds.text_columns:
             raise ExecutionError(description="Python cannot be called on columns of TEXT datatype. "
                                  "For these columns, use the other tools, e.g. Text Question Answering.")
-        df, func_str = self.execute_python(ds, column, new_name, explanation)
-        result = Table(
-            output if output is not None else table, df,
+        values, func_str = self.execute_python(ds, column, new_name, explanation)
+        result = ds.derive(
+            output if output is not None else table,
             f"Result of Python: table={table}, column={column}, new_column={new_name}, code={explanation}",
-            parent=ds
+            new_columns={new_name: values}
         )
 
         # Add the result to the working memory
@@ -57,7 +57,7 @@ class TransformTool(BaseTool):
         return observation
 
     def execute_python(self, ds, column, new_name, explanation):
-        if column not in ds.data_frame.columns:
+        if column not in ds.get_columns():
             raise ExecutionError(description=f"Column {column} does not exist in table {ds.name}.")
         chat_thread = []
         i = 0
@@ -65,9 +65,8 @@ class TransformTool(BaseTool):
             try:
                 func, dtype, func_str = self.get_func(explanation, ds.data_frame[column][:10],
                                                       chat_thread=chat_thread, column=column, new_column=new_name)
-                df = ds.data_frame.copy()
-                df[new_name] = df[column].apply(func).astype(dtype)
-                return df, func_str
+                values = ds.data_frame[column].apply(func).astype(dtype)
+                return values, func_str
             except Exception as e:
                 if i >= 3:
                     raise ExecutionError(description="Python tool failed. Use another tool!")
@@ -1,7 +1,8 @@
 import re
-from caesura.database.database import Database, Table
-from caesura.tools.backend.text_qa import TextQA
-from caesura.tools.base_tool import BaseTool
+import pandas as pd
+from caesura.database.database import Database
+from caesura.tools.backend.registry import models
+from caesura.tools.base_tool import SpeculativeTool
 import logging
 
 from caesura.observations import ExecutionError
@@ -25,7 +26,7 @@ logger = logging.getLogger(__name__)
 MAX_NUM_TEXTS = 200
 
 
-class TextQATool(BaseTool):
+class TextQATool(SpeculativeTool):
     name = "Text Question Answering"
     description = (
         "It is useful for when you want to extract information from texts inside of columns of TEXT datatype. It is Data-GPTs way of reading texts. "
@@ -36,10 +37,11 @@ class TextQATool(BaseTool):
         "The tool adds a new column to the table with the extracted information (e.g. [fever, sore throat, ...]) from each individual text.\n"
     )
     args = ("name of column with TEXT datatype", "name of new column", "question_template", "datatype to automatically cast the result column to [string, int, float, date, boolean]")
+    datatype = "TEXT"
 
     def __init__(self, database: Database):
         super().__init__(database)
-        self.extractor = TextQA()
+        self.extractor = models.handle("text_qa")
 
     def run(self, tables, input_args, output):
         """Use the tool."""
@@ -47,23 +49,33 @@ class TextQATool(BaseTool):
         column, new_column, query, datatype = tuple(input_args)
         if "." in column:
             table, column = column.split(".")
-        texts = self.database.get_column_values(table, column, force_datatype="TEXT")
         # query = self.handle_aggregations(query)
 
-        queries = self.get_queries(table, query)
-        result = self.extractor.extract(texts[:MAX_NUM_TEXTS], queries[:MAX_NUM_TEXTS])
+        result = self.extracted(table, column, query)
         result = convert(result, datatype)
         ds = self.database.get_table_by_name(table)
-        df = ds.data_frame[:MAX_NUM_TEXTS].copy()
-        # Replace spaces and remove special characters
-        df[new_column] = result
-        result = Table(output if output is not None else table, df,
-                       f"Result of text_qa: table={table}, column={column}, query={query}",
-                       parent=ds)
+        result = ds.derive(output if output is not None else table,
+                           f"Result of text_qa: table={table}, column={column}, query={query}",
+                           rows=slice(0, MAX_NUM_TEXTS), new_columns={new_column: result})
 
         # Add the result to the working memory
         return self.database.register_working_memory(result, peek=[new_column])
 
+    def warm_up(self):
+        self.extractor.get()
+
+    def get_speculation_key(self, tables, input_args):
+        table = tables[0]
+        column, _, query, _ = tuple(input_args)
+        if "." in column:
+            table, column = column.split(".")
+        return table, column, query
+
+    def extract(self, table, column, query):
+        texts = self.database.read_column_values(table, column, force_datatype="TEXT")
+        queries = self.get_queries(table, query)
+        return self.extractor.get().extract(texts[:MAX_NUM_TEXTS], queries[:MAX_NUM_TEXTS])
+
     # def handle_aggregations(self, query):
     #     for a in aggregations:
     #         if a in query:
@@ -72,7 +84,7 @@ class TextQATool(BaseTool):
 
     def get_queries(self, table, query):
         placeholders = [x for x in re.findall("<(.+)>", query)]
-        missing = ", ".join(set(placeholders) - set(self.database.tables[table].data_frame.columns))
+        missing = ", ".join(set(placeholders) - set(self.database.tables[table].get_columns()))
         if missing:
             raise ExecutionError(description=f"Missing column(s) {missing} from template placeholder in the table {table}. Maybe rearrange the plan to join first.")
         
@@ -82,5 +94,9 @@ class TextQATool(BaseTool):
                 result = result.replace(f"<{p}>", row[p])
             return result
 
-        queries = self.database.tables[table].data_frame.apply(format_query, axis=1)
+        ds = self.database.tables[table]
+        if not placeholders:
+            return pd.Series([query] * ds.num_rows)
+        rows = pd.DataFrame({p: self.database.read_column_values(table, p) for p in set(placeholders)})
+        queries = rows.apply(format_query, axis=1)
         return queries
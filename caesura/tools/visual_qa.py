@@ -1,8 +1,8 @@
 import re
 
-from caesura.database.database import Database, Table
-from caesura.tools.backend.image_qa import VisualQA
-from caesura.tools.base_tool import BaseTool
+from caesura.database.database import Database
+from caesura.tools.backend.registry import models
+from caesura.tools.base_tool import SpeculativeTool
 from caesura.observations import ExecutionError
 from caesura.utils import convert, get_paths_from_images
 
@@ -20,7 +20,7 @@ aggregations = {
 MAX_NUM_IMAGES = 200
 
 
-class VisualQATool(BaseTool):
+class VisualQATool(SpeculativeTool):
     name = "Visual Question Answering"
     description = (
         "It is useful for when you want to know what is depicted on the images in a column with IMAGE datatype. It is Data-GPTs way of looking at images. "
@@ -30,10 +30,11 @@ class VisualQATool(BaseTool):
         "The question can be anything that can be answered by looking at an image: E.g. How many <x> are depicted? Is <y> depicted? What is in the background? ...\n"
     )
     args = ("name of column with IMAGE datatype", "name of new column with extracted info", "question", "datatype to automatically cast the result column to [string, int, float, date, boolean]")
+    datatype = "IMAGE"
 
     def __init__(self, database: Database):
         super().__init__(database)
-        self.extractor = VisualQA()
+        self.extractor = models.handle("visual_qa")
 
     def run(self, tables, input_args, output):
         """Use the tool."""
@@ -43,21 +44,33 @@ class VisualQATool(BaseTool):
             table, column = column.split(".")
         query = self.handle_aggregations(query)
 
-        images = self.database.get_column_values(table, column, force_datatype="IMAGE")
-        paths = get_paths_from_images(images)
-        result = self.extractor.extract(paths[:MAX_NUM_IMAGES], query)
+        result = self.extracted(table, column, query)
         result = convert(result, datatype)
         ds = self.database.get_table_by_name(table)
-        df = ds.data_frame[:MAX_NUM_IMAGES].copy()
-        # Replace spaces and remove special characters
-        df[new_column] = result
-        result = Table(output if output is not None else table, df,
-                       f"Result of visual_qa: table={table}, column={column}, query={query}",
-                       parent=ds)
+        result = ds.derive(output if output is not None else table,
+                           f"Result of visual_qa: table={table}, column={column}, query={query}",
+                           rows=slice(0, MAX_NUM_IMAGES), new_columns={new_column: result})
 
         # Add the result to the working memory
         return self.database.register_working_memory(result, peek=[new_column])
 
+    def warm_up(self):
+        self.extractor.get()
+
+    def get_speculation_key(self, tables, input_args):
+        table = tables[0]
+        column, _, query, _ = tuple(input_args)
+        if "." in column:
+            table, column = column.split(".")
+        if any(a in query for a in aggregations) and not getattr(self, "error_raised", False):
+            return None  # run raises an error first
+        return table, column, self.handle_aggregations(query)
+
+    def extract(self, table, column, query):
+        images = self.database.read_column_values(table, column, force_datatype="IMAGE")
+        paths = get_paths_from_images(images)
+        return self.extractor.get().extract(paths[:MAX_NUM_IMAGES], query)
+
     def handle_aggregations(self, query):
         for a in aggregations:
             if a in query:
@@ -0,0 +1,119 @@
+import asyncio
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = "trace.json"
+
+_trace = None
+
+
+class _NoopSpan():
+    """Span used while tracing is disabled. A single shared instance, so disabled spans cost one function call."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span():
+    """A timed section of a trace, recorded as a complete event on exit."""
+
+    def __init__(self, trace, name, category, args):
+        self.trace = trace
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.trace.add(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+    def set(self, **args):
+        """Adds arguments to the span, e.g. results that are only known at the end."""
+        self.args.update(args)
+
+
+class Trace():
+    """Events of one trace in the Chrome trace event format."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def add(self, name, category, start, end, args):
+        event = {"name": name, "cat": category, "ph": "X", "ts": (start - self.start) * 1e6,
+                 "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": _track(),
+                 "args": {k: str(v) for k, v in args.items()}}
+        with self._lock:
+            self.events.append(event)
+
+    def save(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def span(name, category="caesura", **args):
+    """Returns a context manager that records a span if tracing is enabled."""
+    if _trace is None:
+        return _NOOP_SPAN
+    return Span(_trace, name, category, args)
+
+
+def start_trace():
+    """Starts recording spans of all threads."""
+    global _trace
+    _trace = Trace()
+    return _trace
+
+
+def stop_trace(path=None):
+    """Stops recording and writes the trace to path, which can be opened in chrome://tracing or Perfetto."""
+    global _trace
+    trace, _trace = _trace, None
+    if trace is not None and path is not None:
+        trace.save(path)
+        logger.info(f"Wrote trace with {len(trace.events)} events to {path}")
+    return trace
+
+
+@contextmanager
+def tracing(path):
+    """Records a trace while the block runs and writes it to path."""
+    start_trace()
+    try:
+        yield
+    finally:
+        stop_trace(path)
+
+
+def _track():
+    """Returns the track of an event: the asyncio task if one is running, as tasks interleave on one thread."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
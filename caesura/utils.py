@@ -1,11 +1,18 @@
 from datetime import datetime
 import re
 import logging
-import dateparser
+import pandas as pd
+
+from caesura.tracing import span
 
 
 logger = logging.getLogger(__name__)
 
+# Image columns store dictionary-encoded paths (pd.Categorical), text columns the text itself.
+# Placeholders are only rendered when serializing values for prompts.
+IMAGE_PLACEHOLDER = "<IMAGE stored at '{}'>"
+TEXT_PLACEHOLDER = "<TEXT>"
+
 number_words = {
     "many": 50,
     "zero": 0,
@@ -42,12 +49,20 @@ number_words = {
 
 def get_paths_from_images(images):
     """Returns the paths of the images."""
-    # images = array(["<IMAGE stored at 'datasets/art/images/img_13.jpg'>", ...)
-    paths = [re.search(r"'(.*)'", x).group(1) for x in images if x is not None]
-    return paths
+    if isinstance(images, pd.Series):
+        images = images.array
+    if isinstance(images, pd.Categorical):
+        return images.categories.take(images.codes[images.codes >= 0]).tolist()
+    return [x for x in images if isinstance(x, str)]
+
+
+def render_image_placeholders(images):
+    """Renders the image paths of a column as placeholders for prompts."""
+    return pd.Series(images, dtype=object).map(IMAGE_PLACEHOLDER.format, na_action="ignore")
 
 def convert(data, datatype):
-    return [_convert(d, datatype) for d in data]
+    with span("convert", "tool", datatype=datatype, num_values=len(data)):
+        return [_convert(d, datatype) for d in data]
 
 def _convert(data, datatype):
     if datatype in ("int", "float", "boolean") and data in number_words:
@@ -68,6 +83,7 @@ def _convert(data, datatype):
         except:
             return 0.0
     if datatype == "date":
+        import dateparser  # slow to import, only needed for dates
         try:
             return dateparser.parse(data)
         except:
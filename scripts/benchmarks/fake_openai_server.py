@@ -0,0 +1,72 @@
+"""Local stand-in for the OpenAI chat completions endpoint, to measure request concurrency and latency offline.
+
+python scripts/benchmarks/fake_openai_server.py --port=8765 --delay=0.5
+Point the LLM at it with openai_api_base="http://127.0.0.1:8765/v1". GET / returns request statistics.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import re
+import threading
+import time
+import fire
+
+
+def make_handler(delay, answer):
+    lock = threading.Lock()
+    stats = {"requests": 0, "concurrent": 0, "max_concurrent": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            with lock:
+                self._send_json(stats)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with lock:
+                stats["requests"] += 1
+                stats["concurrent"] += 1
+                stats["max_concurrent"] = max(stats["max_concurrent"], stats["concurrent"])
+            try:
+                time.sleep(delay)
+                if body.get("stream"):
+                    self._stream(answer)
+                else:
+                    self._send_json({
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": answer}}],
+                        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}})
+            finally:
+                with lock:
+                    stats["concurrent"] -= 1
+
+        def _send_json(self, data):
+            data = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for token in re.findall(r"\S+\s*", text):
+                chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return Handler
+
+
+def run_server(port: int = 8765, delay: float = 0.5, answer: str = "N/A"):
+    ThreadingHTTPServer(("127.0.0.1", port), make_handler(delay, answer)).serve_forever()
+
+
+if __name__ == "__main__":
+    fire.Fire(run_server)
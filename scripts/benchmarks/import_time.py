@@ -0,0 +1,55 @@
+"""Guards the startup time of the entry points, measured with python -X importtime.
+
+python scripts/benchmarks/import_time.py --budget=1.5
+Exits with status 1 if an entry point takes longer than the budget (in seconds) to import, or imports one of the
+heavy dependencies that should only be imported by the code paths that need them.
+"""
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+import fire
+
+
+ROOT = Path(__file__).resolve().parents[2]
+ENTRY_POINTS = {
+    "caesura/main.py": "import caesura.main",
+    "scripts/run_experiment.py": "import runpy; runpy.run_path('scripts/run_experiment.py')",
+}
+DEFERRED = ("torch", "transformers", "chromadb", "seaborn", "matplotlib", "tqdm", "langchain", "openai", "dateparser")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(code):
+    """Returns the import time in seconds, the imports of the first two levels with their cumulative seconds and all
+    imported modules."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), os.environ.get("PYTHONPATH")]))}
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True).stderr
+    total, imports, modules = 0, {}, set()
+    for self_us, cumulative_us, indent, name in LINE.findall(out):
+        total += int(self_us)
+        modules.add(name)
+        if len(indent) <= 3:
+            imports[name] = int(cumulative_us) / 1e6
+    return total / 1e6, imports, modules
+
+
+def check(budget: float = 1.5, repeat: int = 3, top: int = 5):
+    failed = False
+    for entry_point, code in ENTRY_POINTS.items():
+        total, imports, modules = min((measure(code) for _ in range(repeat)), key=lambda x: x[0])
+        heavy = sorted(m for m in DEFERRED if m in modules)
+        print(f"{entry_point}: {total:.2f}s (budget {budget:.2f}s)")
+        for name, seconds in sorted(imports.items(), key=lambda x: -x[1])[:top]:
+            print(f"  {seconds:.3f}s {name}")
+        if heavy:
+            print(f"  imports deferred dependencies: {', '.join(heavy)}")
+        failed |= total > budget or bool(heavy)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    fire.Fire(check)
@@ -0,0 +1,118 @@
+"""Compares build time, lookup latency and memory of the relevant value index against the previous pandas version.
+
+python scripts/benchmarks/relevant_values_index.py --num_values=200000
+python scripts/benchmarks/relevant_values_index.py --csv=datasets/art/paintings.csv --column=name
+"""
+import time
+import tracemalloc
+import fire
+import numpy as np
+import pandas as pd
+
+from caesura.database.index import RelevantValueIndex
+
+
+class PandasRelevantValueIndex():
+    """The previous implementation based on explode and groupby."""
+
+    def __init__(self, n=5, padding=4):
+        self.map = None
+        self.values = set()
+        self.n = n
+        self.padding = padding
+
+    def build(self, values):
+        values = pd.Series(values)
+        self.map = pd.DataFrame({"values": values, "n-grams": values.map(self._get_n_grams)})
+        self.map = self.map.explode("n-grams")
+        self.map = self.map.groupby("n-grams").agg(list)
+        self.values = set(values)
+
+    def get_relevant_values(self, *keywords, num=10):
+        n_grams = self.get_n_grams(*keywords)
+        n_grams = [x for x in n_grams if x in self.map.index]
+        values = self.map.loc[n_grams]
+        values = values.explode("values")["values"].value_counts(sort=True).index
+        values = values[:num].tolist()
+        values += self.get_remaining(values, num)
+        return values
+
+    def get_remaining(self, values, total_num):
+        values = set(values)
+        sample = list()
+        num = total_num - len(values)
+        for element in self.values:
+            if element not in values:
+                sample.append(element)
+            if len(sample) >= num:
+                break
+        return sample
+
+    def memory_usage(self):
+        return int(self.map.memory_usage(deep=True).sum())
+
+    def get_n_grams(self, *keywords):
+        result = set()
+        for k in keywords:
+            result |= self._get_n_grams(k)
+        return list(result)
+
+    def _get_n_grams(self, keyword):
+        result = set()
+        if pd.isna(keyword):
+            keyword = ""
+        keyword = str(keyword) or ""
+        for i in range(-self.padding, len(keyword) - self.n + self.padding + 1):
+            pre_padding = "#" * max(-i, 0)
+            post_padding = "#" * max(i + self.n - len(keyword), 0)
+            n_gram = pre_padding + keyword[max(i, 0): max(i + self.n, 0)] + post_padding
+            result.add(n_gram)
+        return result
+
+
+def synthetic_values(num_values, seed):
+    rng = np.random.default_rng(seed=seed)
+    syllables = np.array(["an", "bel", "cor", "da", "el", "fra", "gio", "hal", "ive", "jo", "ka", "lu", "mar",
+                          "nes", "or", "pi", "quin", "ro", "sa", "tor", "u", "van", "wil", "xe", "yo", "zin"])
+    words = syllables[rng.integers(0, len(syllables), (num_values, 4))]
+    words = pd.Series(words[:, 0]).str.cat(list(words[:, 1:].T)).str.capitalize()
+    values = pd.Series(words[rng.integers(0, len(words), num_values)].values)
+    values = values.str.cat(words[rng.integers(0, len(words), num_values)].values, sep=" ")
+    return values.unique()
+
+
+def measure(index_type, values, queries, num):
+    start = time.perf_counter()
+    index = index_type()
+    index.build(values)
+    build_time = time.perf_counter() - start
+
+    tracemalloc.start()  # separate build, tracing distorts the build time
+    index_type().build(values)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for q in queries:
+        index.get_relevant_values(*q, num=num)
+    lookup_time = (time.perf_counter() - start) / len(queries)
+    return dict(build_s=round(build_time, 3), lookup_ms=round(lookup_time * 1000, 3),
+                peak_build_mb=round(peak_memory / 2 ** 20, 1), index_mb=round(index.memory_usage() / 2 ** 20, 1))
+
+
+def run_benchmark(num_values: int = 100_000, csv: str = None, column: str = None,
+                  num_queries: int = 100, num: int = 10, seed: int = 42):
+    if csv is not None:
+        values = pd.read_csv(csv)[column].unique()
+    else:
+        values = synthetic_values(num_values, seed)
+    rng = np.random.default_rng(seed=seed)
+    queries = [[str(v).split()[0].lower()] for v in rng.choice(np.asarray(values, dtype=object), num_queries)]
+
+    print(f"{len(values)} distinct values, {len(queries)} lookups")
+    for name, index_type in (("pandas (previous)", PandasRelevantValueIndex), ("inverted CSR", RelevantValueIndex)):
+        print(f"{name:>20}: {measure(index_type, values, queries, num)}")
+
+
+if __name__ == "__main__":
+    fire.Fire(run_benchmark)
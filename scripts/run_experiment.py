@@ -2,9 +2,11 @@ import datetime
 import itertools
 import pathlib
 import re
+import time
 import numpy as np
 import fire
 from caesura.main import Caesura
+from caesura.metrics import metrics
 
 from caesura.scenarios import get_database
 
@@ -199,7 +201,14 @@ MODELS = {
 
 
 def run_experiment(dataset: str = None, model: int = None,
-                   seed: int = 43, num_samples_per_template:int = 1, skip_queries: int = -1):
+                   seed: int = 43, num_samples_per_template:int = 1, skip_queries: int = -1,
+                   memory_budget_mb: float = None, lazy: bool = False, peek_token_budget: int = None,
+                   replay: str = None, metrics_port: int = None, trace: bool = False):
+    """Runs the queries. With replay set to the time string of a previous run, its recorded LLM responses are used.
+    With metrics_port set, metrics are served in the Prometheus text format on that port. With trace, a Chrome trace
+    of each query is written next to its out.log."""
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
     model = list(MODELS.values()) if model is None else (MODELS[int(model)], )
     datasets = ("artwork", "rotowire") if dataset is None else (dataset, )
 
@@ -218,10 +227,22 @@ def run_experiment(dataset: str = None, model: int = None,
             path = pathlib.Path("experiments") / m / time_string  / "ours" / f"query_{i}"
             db_name = q.template.scenario
             if db_name != previous_db_name:
-                db = get_database(db_name, sampled=False)
+                db = get_database(db_name, sampled=False, lazy=lazy)
+                if memory_budget_mb is not None:
+                    db.memory_budget = int(memory_budget_mb * 2 ** 20)
+                db.peek_token_budget = peek_token_budget
                 previous_db_name = db_name
-            agent = Caesura(db, model_name=m, interactive=False, log_path=path)
+            replay_path = None if replay is None else pathlib.Path("experiments") / m / replay / "ours" / f"query_{i}"
+            agent = Caesura(db, model_name=m, interactive=False, log_path=path, replay_path=replay_path,
+                            trace=trace)
+            start = time.perf_counter()
             agent.run(str(q))
+            if replay is not None:
+                print(f"Replay ({time.perf_counter() - start:.2f}s):", dict(agent.llm.replay_counters))
+            if agent.llm_cache is not None:
+                print("LLM cache:", agent.llm_cache.get_stats())
+            if peek_token_budget is not None:
+                print("Serialization:", dict(db.serializer.counters))
 
 
 if __name__ == "__main__":